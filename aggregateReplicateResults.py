@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+helptext = '''Summarizes replicate optimization results. Expects a list of report files
+that may include placeholders like * and [1-4]. Replicates of the same
+model must be named `someName_N.txt`, as generated by `parallelCopasi.py`.
+For every model, the best, median, mean, spread and quantiles of the
+objective function values are computed. For every parameter, the value
+of the best replicate and quantiles over the best replicates (parameter
+consensus) are computed. Reports without result count as failed.
+
+Two tab-separated files are written: the model summary (default
+replicate_summary.tsv) and the parameter summary (default
+replicate_summary_parameters.tsv).
+
+Start the script e.g. like this:
+./aggregateReplicateResults.py myModel_*.txt otherModel_*.txt'''
+
+
+import sys						# For stderr printing
+import re						# Regular expressions
+import os.path					# Common path name manipulations
+import warnings					# To silence warnings about parameters without values
+import numpy as np				# Vectorised statistics
+from copasi import readOptimizationReport	# To parse the reports
+
+
+def groupReplicates(filenames):
+	"""
+	Groups report files by model. The model name is the file name without extension and replicate number (path/myModel_12.txt -> path/myModel). Files without replicate number form a model of their own.
+
+	:param filenames: A list of report files
+	:returns: A dictionary {model: [filename, ...]}
+	"""
+
+	models = {}
+	for filename in filenames:
+		base = os.path.splitext(filename)[0]
+		reResult = re.match(r'(.+)_\d+$', base)
+		model = reResult.group(1) if reResult is not None else base
+		models.setdefault(model, []).append(filename)
+
+	return models
+
+
+def summarizeReplicates(results, quantiles = (0.05, 0.25, 0.5, 0.75, 0.95), top = 0.1, maximize = False):
+	"""
+	Computes statistics over the replicates of a single model.
+
+	:param results: A list of results as returned by readOptimizationReport() (None for failed replicates)
+	:param quantiles: The quantiles (0-1) to compute for objective values and parameters
+	:param top: Fraction of the best replicates that is used for the parameter quantiles (at least one replicate is used)
+	:param maximize: Whether the optimization maximized the objective function
+	:returns: A tuple (modelStats, parameterNames, parameterStats). modelStats is a dictionary, parameterStats a dictionary of NumPy arrays with one entry per parameter (or None, if no replicate succeeded)
+	"""
+
+	valid = [result for result in results if result is not None]
+	modelStats = {'replicates': len(results), 'failed': len(results) - len(valid)}
+	if not valid:
+		return modelStats, [], None
+
+	# Replicates may lack parameters (e.g. other Copasi versions), so we use the union and NaN for missing values
+	parameterNames = sorted(set(name for result in valid for name in result['parameters']))
+	objectives = np.array([result['objective'] for result in valid])
+	parameters = np.array([[result['parameters'].get(name, np.nan) for name in parameterNames] for result in valid]).reshape(len(valid), len(parameterNames))
+
+	# Sort the replicates from best to worst
+	order = np.argsort(-objectives if maximize else objectives, kind='stable')
+	objectives = objectives[order]
+	parameters = parameters[order]
+	best = parameters[:max(1, int(round(top * len(valid))))]
+
+	objectiveQuantiles = np.quantile(objectives, quantiles)
+	modelStats.update({
+		'best': objectives[0],
+		'median': np.median(objectives),
+		'mean': objectives.mean(),
+		'std': objectives.std(ddof=1) if len(objectives) > 1 else 0.0,
+		'worst': objectives[-1],
+		'iqr': np.subtract(*np.quantile(objectives, (0.75, 0.25))),
+		'quantiles': objectiveQuantiles,
+	})
+
+	parameterStats = {'best': parameters[0], 'used': np.sum(~np.isnan(best), axis=0)}
+	if len(parameterNames) > 0:
+		# Parameters without any value in the best replicates give NaN (and a warning we do not need)
+		with np.errstate(all='ignore'), warnings.catch_warnings():
+			warnings.simplefilter('ignore', category=RuntimeWarning)
+			parameterStats['quantiles'] = np.nanquantile(best, quantiles, axis=0)
+			parameterStats['median'] = np.nanmedian(best, axis=0)
+			lower, upper = np.nanquantile(best, (0.25, 0.75), axis=0)
+			# The relative spread of the best solutions shows how well a parameter is determined
+			parameterStats['relativeIqr'] = (upper - lower) / np.abs(parameterStats['median'])
+	else:
+		parameterStats['quantiles'] = np.empty((len(quantiles), 0))
+		parameterStats['median'] = np.empty(0)
+		parameterStats['relativeIqr'] = np.empty(0)
+
+	return modelStats, parameterNames, parameterStats
+
+
+def aggregate(filenames, outfile = 'replicate_summary.tsv', quantiles = (0.05, 0.25, 0.5, 0.75, 0.95), top = 0.1, maximize = False):
+	"""
+	Reads all reports, computes the replicate statistics for every model and writes the summary files.
+
+	:param filenames: A list of report files
+	:param outfile: The file name of the model summary. The parameter summary gets the suffix "_parameters"
+	:param quantiles: The quantiles (0-1) to compute for objective values and parameters
+	:param top: Fraction of the best replicates that is used for the parameter quantiles
+	:param maximize: Whether the optimization maximized the objective function
+	:returns: A tuple with the file names of the model summary and the parameter summary
+	"""
+
+	qNames = ['q{:g}'.format(q * 100) for q in quantiles]
+	fmt = lambda x: '{:.6g}'.format(x)
+
+	modelLines = ['\t'.join(['model', 'replicates', 'failed', 'best', 'median', 'mean', 'std', 'worst', 'iqr'] + qNames)]
+	parameterLines = ['\t'.join(['model', 'parameter', 'best', 'median', 'relative_iqr', 'used'] + qNames)]
+
+	for model, files in sorted(groupReplicates(filenames).items()):
+		results = []
+		for filename in files:
+			try:
+				results.append(readOptimizationReport(filename))
+			except OSError as e:
+				print('Could not read {}: {}. Counting it as failed.'.format(filename, e), file=sys.stderr)
+				results.append(None)
+
+		modelStats, parameterNames, parameterStats = summarizeReplicates(results, quantiles, top, maximize)
+		if parameterStats is None:
+			modelLines.append('\t'.join([model, str(modelStats['replicates']), str(modelStats['failed'])] + ['na'] * (6 + len(quantiles))))
+			continue
+
+		modelLines.append('\t'.join([model, str(modelStats['replicates']), str(modelStats['failed'])] + [fmt(modelStats[key]) for key in ('best', 'median', 'mean', 'std', 'worst', 'iqr')] + [fmt(x) for x in modelStats['quantiles']]))
+		for n, name in enumerate(parameterNames):
+			parameterLines.append('\t'.join([model, name, fmt(parameterStats['best'][n]), fmt(parameterStats['median'][n]), fmt(parameterStats['relativeIqr'][n]), str(parameterStats['used'][n])] + [fmt(x) for x in parameterStats['quantiles'][:, n]]))
+
+	parameterFile = os.path.splitext(outfile)[0] + '_parameters' + os.path.splitext(outfile)[1]
+	with open(outfile, 'w') as f:
+		f.write('\n'.join(modelLines) + '\n')
+	with open(parameterFile, 'w') as f:
+		f.write('\n'.join(parameterLines) + '\n')
+
+	return outfile, parameterFile
+
+
+if __name__ == '__main__':
+	import argparse				# To parse arguments
+	from glob import glob		# To expand placeholders
+
+	# Create a new argument parser object
+	parser = argparse.ArgumentParser(description=helptext, formatter_class=argparse.RawDescriptionHelpFormatter)
+	# We need the report files
+	parser.add_argument('files', nargs='+', metavar='myModel_1.txt', help='Report files of the replicates. May include placeholders like * and [1-4].')
+	# Optionally, we take the name of the output file
+	parser.add_argument('-o', '--outfile', default='replicate_summary.tsv', metavar='summary.tsv', help='File name of the model summary. The parameter summary gets the suffix "_parameters".')
+	# Optionally, we take the quantiles to compute
+	parser.add_argument('-q', '--quantiles', type=lambda x: tuple(float(q) for q in x.split(',')), default=(0.05, 0.25, 0.5, 0.75, 0.95), metavar='0.05,0.5,0.95', help='Quantiles (0-1) of objective values and parameters, seperated by kommas (,).')
+	# Optionally, we take the fraction of best replicates for the parameter consensus
+	parser.add_argument('-t', '--top', type=float, default=0.1, metavar='fraction', help='Fraction of the best replicates that is used for the parameter quantiles. Defaults to 0.1.')
+	# Optionally, the objective was maximized
+	parser.add_argument('-M', '--maximize', action='store_true', help='The optimization maximized the objective function (the default is minimization).')
+	args = parser.parse_args()
+
+	filenames = []
+	for fn in args.files:
+		filenames.extend(glob(fn))
+
+	aggregate(filenames, args.outfile, args.quantiles, args.top, args.maximize)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+helptext = '''Measures how much slimming a Copasi file (see Copasi.slimModel())
+reduces the time CopasiSE needs per job. The file and its slimmed copy
+are run alternately several times. By default, all tasks are unscheduled
+in both copies, so CopasiSE only reads the file and the time per job is
+its startup time. With --full, the scheduled tasks are run as well. The
+program and version of CopasiSE are printed with the results, as the
+startup time depends on them. Runs that fail (e.g. because CopasiSE
+cannot read the slimmed file) are reported.
+
+Start the script e.g. like this:
+./benchmarkSlimming.py myModel.cps -r 20'''
+
+
+import os.path					# Common path name manipulations
+import subprocess				# To start Copasi
+import tempfile					# For the copies of the Copasi file
+import time						# To measure the runtime of Copasi
+import statistics				# Median and mean of the runtimes
+from shutil import which		# To print the full path of CopasiSE
+from copasi import Copasi		# Copasi class for all modifications
+
+
+def benchmark(cpsFile, copasiPath = 'copasise', repeats = 10, full = False, keepTasks = ()):
+	"""
+	Runs CopasiSE alternately on a Copasi file and its slimmed copy and prints the sizes and runtimes per job.
+
+	:param cpsFile: The Copasi file
+	:param copasiPath: Path to CopasiSE or it's name in the PATH variable. Defaults to 'copasise'
+	:param repeats: Number of runs of every copy
+	:param full: If True, the scheduled tasks are run. Otherwise, only the startup time is measured
+	:param keepTasks: Names of unscheduled tasks that shall be kept by the slimming
+	:returns: A dictionary {'original'/'slimmed': {'bytes': int, 'failures': int, 'median': float, 'mean': float, 'min': float}}
+	"""
+
+	original = Copasi(cpsFile)
+	copasiPath = original.checkCopasiSE(copasiPath)
+	# CopasiSE runs in the temporary directory, so a relative path to CopasiSE has to be made absolute
+	if os.sep in copasiPath:
+		copasiPath = os.path.abspath(copasiPath)
+	slimmed = Copasi(cpsFile)
+	saved = slimmed.slimModel(keepTasks)
+
+	results = {}
+	with tempfile.TemporaryDirectory(prefix = 'slim_', dir = os.path.dirname(os.path.abspath(cpsFile))) as tmpDir:
+		files = {}
+		for label, copasi in (('original', original), ('slimmed', slimmed)):
+			content = copasi.content
+			if not full:
+				content = content.replace('scheduled="true"', 'scheduled="false"')
+			files[label] = os.path.join(tmpDir, label + '.cps')
+			with open(files[label], 'w', encoding='utf-8') as f:
+				f.write(content)
+			results[label] = {'bytes': len(content.encode('utf-8'))}
+
+		# The copies run alternately, so changing load of the machine affects both the same way
+		times = {label: [] for label in files}
+		failures = {label: 0 for label in files}
+		for _ in range(repeats):
+			for label, filename in files.items():
+				start = time.perf_counter()
+				exitCode = subprocess.run([copasiPath, filename], cwd = tmpDir, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL).returncode
+				times[label].append(time.perf_counter() - start)
+				failures[label] += exitCode != 0
+
+	for label in files:
+		results[label].update({'failures': failures[label], 'median': statistics.median(times[label]), 'mean': statistics.mean(times[label]), 'min': min(times[label])})
+
+	for label, n in failures.items():
+		if n:
+			original._errorReport('CopasiSE failed in {} of {} runs of the {} copy. Its runtimes are not comparable.'.format(n, repeats, label))
+
+	# The first line of the help is the version, e.g. COPASI 4.15 (Build 95)
+	version = subprocess.run([copasiPath, '-h'], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, universal_newlines = True).stdout.split('\n')[0]
+	print('CopasiSE: {} ({})'.format(which(copasiPath) or copasiPath, version))
+	print('Removed bytes: {}'.format(', '.join('{} {}'.format(part, n) for part, n in saved.items())))
+	print('{} runs per copy, {}:'.format(repeats, 'full jobs' if full else 'startup only'))
+	print('copy\tbytes\tmedian [s]\tmean [s]\tmin [s]')
+	for label, result in results.items():
+		print('{}\t{}\t{:.4f}\t{:.4f}\t{:.4f}'.format(label, result['bytes'], result['median'], result['mean'], result['min']))
+	print('Reduction: {:.1%} of the bytes, {:.1%} of the median time per job'.format(1 - results['slimmed']['bytes'] / results['original']['bytes'], 1 - results['slimmed']['median'] / results['original']['median']))
+
+	return results
+
+
+if __name__ == '__main__':
+	import argparse				# To parse arguments
+
+	# Create a new argument parser object
+	parser = argparse.ArgumentParser(description=helptext, formatter_class=argparse.RawDescriptionHelpFormatter)
+	# We need one input file
+	parser.add_argument('infile', metavar='myfile.cps', help='Copasi file to benchmark.')
+	# Optionally, we take the path to CopasiSE
+	parser.add_argument('-c', '--copasi', default='copasise', metavar='path/to/copasise', help='Path to CopasiSE or its name in the PATH variable.')
+	# Optionally, we take the number of runs
+	parser.add_argument('-r', '--repeats', type=int, default=10, metavar='#', help='Number of runs of the original and the slimmed copy. Defaults to 10.')
+	# Optionally, we run the scheduled tasks as well
+	parser.add_argument('-f', '--full', action='store_true', help='Run the scheduled tasks instead of measuring the startup time only.')
+	# Optionally, we keep some unscheduled tasks
+	parser.add_argument('-k', '--keep', nargs='+', default=(), metavar='task', help='Names of unscheduled tasks that shall be kept, e.g. "Metabolic Control Analysis".')
+	args = parser.parse_args()
+
+	benchmark(args.infile, args.copasi, args.repeats, args.full, args.keep)
@@ -4,8 +4,336 @@ import sys						# For exiting and stderr printing
 import re						# Regular expressions
 import os.path					#Common path name manipulations
 import subprocess				# To start subprocesses like GNU parallel or Copasi
+import hashlib					# To shard output files into subdirectories
+import threading				# To limit the number of pending writes and to generate variants while CopasiSE runs
+import queue					# To hand generated variants over to CopasiSE
+import tempfile					# For the files of method races
+from concurrent.futures import ThreadPoolExecutor	# To write many files in parallel
 from datetime import datetime	# To get a feeling of time
 from shutil import which		# To check whether a given Copasi program name is valid
+from copasiExecutor import CopasiExecutor, ChunkedCopasiExecutor, ProgressReporter, effectiveCpuCount	# To run CopasiSE with timeouts, speculative execution, memory-aware admission, chunks and progress reports
+from distributedCopasi import Coordinator	# To run CopasiSE on other hosts
+
+def readOptimizationReport(filename):
+	"""
+	Reads the result of an optimization from a Copasi report file. If the report contains several results, the last one is used. The result block looks like this (counters and parameters are seperated by an empty line):
+
+	    Objective Function Value:	0.123
+	    Function Evaluations:	8000
+	    CPU Time [s]:	1.2
+	    Evaluations/second [1/s]:	6666
+
+	    Values[k1].InitialValue: 0.5
+	    (R1).k2: 12
+
+	:param filename: The report file
+	:returns: A dictionary {'objective': float, 'evaluations': float or None, 'parameters': {name: float}} or None if no result was found
+	"""
+
+	with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+		content = f.read()
+
+	# Searching from the end is much faster for reports with long tables in front of the result
+	start = content.rfind('Objective Function Value:')
+	if start == -1:
+		return None
+
+	counters = {'Function Evaluations', 'CPU Time [s]', 'Evaluations/second [1/s]'}
+	result = {'objective': None, 'evaluations': None, 'parameters': {}}
+
+	lines = iter(content[start:].split('\n'))
+	# The counters end with the first empty line
+	for n, line in enumerate(lines):
+		line = line.strip()
+		if not line:
+			break
+		name, _, value = line.rpartition(':')
+		try:
+			value = float(value)
+		except ValueError:
+			continue
+		name = name.strip()
+		if n == 0:
+			result['objective'] = value
+		elif name == 'Function Evaluations':
+			result['evaluations'] = value
+		elif name not in counters:
+			result['parameters'][name] = value
+
+	# The parameters follow and end with the next empty line or anything that is not »name: value«
+	for line in lines:
+		line = line.strip()
+		name, _, value = line.rpartition(':')
+		try:
+			value = float(value)
+		except ValueError:
+			break
+		if not name.strip():
+			break
+		result['parameters'][name.strip()] = value
+
+	if result['objective'] is None:
+		return None
+
+	return result
+
+
+def shardDirectory(filename, levels = 1):
+	"""
+	Determines the hashed subdirectories for a file. The hash only depends on the file name without path and extension, so a Copasi file and its report end up in the same directory (e.g. myModel_R1_R2.cps -> 3f/myModel_R1_R2.cps).
+
+	:param filename: The file name (may include some path)
+	:param levels: The number of nested subdirectories with 256 entries each
+	:returns: The path of the subdirectories (empty for levels = 0)
+	"""
+
+	digest = hashlib.md5(os.path.splitext(os.path.basename(filename))[0].encode('utf-8')).hexdigest()
+	return os.path.join(*[digest[2*n:2*n+2] for n in range(levels)]) if levels > 0 else ''
+
+
+def shardedPath(filename, levels = 1):
+	"""
+	Inserts the hashed subdirectories (see shardDirectory()) between the path and the name of a file.
+
+	:param filename: The file name (may include some path)
+	:param levels: The number of nested subdirectories
+	:returns: The file name including the shard directories
+	"""
+
+	directory, name = os.path.split(filename)
+	return os.path.join(directory, shardDirectory(name, levels), name)
+
+
+class BulkWriter:
+	"""
+	Writes many files through a thread pool. Optionally, files are sharded into hashed subdirectories (see shardDirectory()) to keep directories small, and a manifest maps keys (e.g. the optimization targets) to the written files.
+	"""
+
+	def __init__(self, workers = 8, shardLevels = 0, manifest = None, keyNames = ('row', 'column'), errorReport = None):
+		"""
+		:param workers: Number of threads that write files
+		:param shardLevels: Number of levels of hashed subdirectories. 0 writes the files where they are named
+		:param manifest: File name of the manifest (tab-separated keys and path) or None for no manifest
+		:param keyNames: Column names of the keys in the manifest
+		:param errorReport: Function to report errors with (e.g. Copasi._errorReport)
+		"""
+
+		self.shardLevels = shardLevels
+		self.manifest = manifest
+		self.keyNames = keyNames
+		self.errorReport = errorReport
+		self.pool = ThreadPoolExecutor(max_workers=workers)
+		self.slots = threading.BoundedSemaphore(workers * 4)	# Limits the contents kept in memory
+		self.lock = threading.Lock()
+		self.directories = set()	# Directories that are known to exist
+		self.entries = []			# Lines of the manifest
+		self.errors = []
+
+
+	def path(self, filename):
+		"""
+		Determines where a file will be written.
+
+		:param filename: The name for the file (may include some path)
+		:returns: The sanitized file name including the shard directories
+		"""
+
+		# The hash is taken over the sanitized name, as readers of the files (e.g. extractMCAOptimizationResults.py) only know that one
+		return shardedPath(''.join(c for c in filename if c.isalnum() or c in ('.', '_', '/')), self.shardLevels)
+
+
+	def write(self, filename, content, key = None, callback = None):
+		"""
+		Queues a file for writing. Blocks if too many files are pending.
+
+		:param filename: The file name as returned by path()
+		:param content: The content of the file as a string
+		:param key: A tuple of strings for the manifest or None
+		:param callback: A function that is called with the file name once the file is written or None
+		:returns: The file name
+		"""
+
+		self.slots.acquire()
+		if key is not None and self.manifest is not None:
+			self.entries.append('\t'.join(tuple(key) + (filename,)))
+		self.pool.submit(self._write, filename, content, callback)
+
+		return filename
+
+
+	def _write(self, filename, content, callback):
+		"""
+		Writes a single file. Runs in a thread of the pool.
+
+		:param filename: The file name
+		:param content: The content of the file as a string
+		:param callback: A function that is called with the file name once the file is written or None
+		"""
+
+		try:
+			directory = os.path.dirname(filename)
+			if directory and directory not in self.directories:
+				os.makedirs(directory, exist_ok=True)
+				with self.lock:
+					self.directories.add(directory)
+			with open(filename, 'w', encoding='utf-8') as f:
+				f.write(content)
+			if callback is not None:
+				callback(filename)
+		except OSError as e:
+			with self.lock:
+				self.errors.append('{}: {}'.format(filename, e))
+		finally:
+			self.slots.release()
+
+
+	def close(self):
+		"""
+		Waits until all files are written and writes the manifest. Errors are reported as fatal.
+		"""
+
+		self.pool.shutdown(wait=True)
+
+		if self.errors:
+			self.errorReport('An OS Error was raised while writing {} output files.\n{}'.format(len(self.errors), '\n'.join(self.errors[:10])), fatal = True)
+
+		if self.manifest is not None:
+			try:
+				with open(self.manifest, 'w', encoding='utf-8') as f:
+					f.write('\t'.join(tuple(self.keyNames) + ('path',)) + '\n')
+					f.write('\n'.join(self.entries) + '\n')
+			except OSError as e:
+				self.errorReport('An OS Error was raised while writing the manifest.\n{}'.format(e), fatal = True)
+
+
+def parseMethodSpec(spec):
+	"""
+	Turns a method specification like »EP:generations=100,population=30« or »PS:iterations=500« into keyword arguments for Copasi.setOptimizationMethod(). Can be used as type for argparse.
+
+	:param spec: The specification as a string
+	:returns: A dictionary {'method': str, parameter: number, ...}
+	:raises ValueError: If the method or a parameter is unknown
+	"""
+
+	parameters = {'generations': int, 'population': int, 'iterations': int, 'swarmSize': int, 'stdDeviation': float, 'seed': int}
+
+	method, _, options = spec.partition(':')
+	if method not in ('EP', 'PS'):
+		raise ValueError('Unknown optimization method: {}'.format(method))
+
+	result = {'method': method}
+	for option in filter(None, options.split(',')):
+		name, _, value = option.partition('=')
+		if name not in parameters:
+			raise ValueError('Unknown parameter of the optimization method: {}'.format(name))
+		result[name] = parameters[name](value)
+
+	return result
+
+
+def parseMethodList(specs):
+	"""
+	Turns a comma-separated list of method specifications like »EP:generations=100,population=30,PS:iterations=500« into a list of keyword arguments for Copasi.setOptimizationMethod(). Every method name (upper case) starts a new specification, as parameter names are lower case. Can be used as type for argparse.
+
+	:param specs: The specifications as a string
+	:returns: A list of dictionaries (see parseMethodSpec())
+	:raises ValueError: If a method or a parameter is unknown
+	"""
+
+	return [parseMethodSpec(spec) for spec in re.split(r',(?=[A-Z]+(?::|,|$))', specs)]
+
+
+def formatMethodSpec(method):
+	"""
+	Turns keyword arguments for Copasi.setOptimizationMethod() back into a specification (see parseMethodSpec()).
+
+	:param method: A dictionary {'method': str, parameter: number, ...}
+	:returns: The specification as a string
+	"""
+
+	options = ','.join('{}={}'.format(name, value) for name, value in sorted(method.items()) if name != 'method')
+	return method['method'] + (':' + options if options else '')
+
+
+class WarmStart:
+	"""
+	Collects the best parameters of previous MCA optimization scans to use them as start values of new variants. Reports must be named `someName_row_column.txt` or `someName_row_column_N.txt` (as generated by updateMCAOptimizationTarget.py with and without -j). If there are several reports for the same pair of targets, the best one is used.
+	"""
+
+	def __init__(self, reportFiles, maximize = False, rows = None, columns = None):
+		"""
+		:param reportFiles: A list of report files of previous scans
+		:param maximize: Whether the optimization maximizes the objective function
+		:param rows: The names of all left objectives of the model or None. Used to tell the target names from the rest of the file name
+		:param columns: The names of all right objectives of the model or None
+		"""
+
+		self.results = {}	# (row, column) -> result of readOptimizationReport()
+
+		for filename in reportFiles:
+			target = self._targets(filename, rows, columns)
+			if target is None:
+				print('{} is not named like someName_row_column.txt. Skipping it for the warm start.'.format(filename), file=sys.stderr)
+				continue
+			result = readOptimizationReport(filename)
+			if result is None or not result['parameters']:
+				continue
+			previous = self.results.get(target)
+			if previous is None or (result['objective'] > previous['objective'] if maximize else result['objective'] < previous['objective']):
+				self.results[target] = result
+
+
+	def _targets(self, filename, rows = None, columns = None):
+		"""
+		Extracts the pair of targets from the name of a report. Names that end with a number may come from a jobarray (someName_row_column_N) or have a number as column. If the names of the model are given, the interpretation that fits them is used, otherwise the jobarray.
+
+		:param filename: The report file
+		:param rows: The names of all left objectives of the model or None
+		:param columns: The names of all right objectives of the model or None
+		:returns: A tuple (row, column) with the names of the model, if given, or None if the name does not fit
+		"""
+
+		base = os.path.splitext(os.path.basename(filename))[0]
+		candidates = [reResult.groups() for reResult in (re.match(r'^.+_([^_]+)_([^_]+)_\d+$', base), re.match(r'^.+_([^_]+)_([^_]+)$', base)) if reResult is not None]
+
+		if rows is not None and columns is not None:
+			# The file names only contain sanitized target names, so they are mapped back to the names of the model
+			sanitize = lambda name: ''.join(c for c in name if c.isalnum() or c in ('.', '_', '/'))
+			rowNames = {sanitize(name): name for name in rows}
+			columnNames = {sanitize(name): name for name in columns}
+			candidates = [(rowNames[row], columnNames[column]) for row, column in candidates if row in rowNames and column in columnNames]
+
+		return candidates[0] if candidates else None
+
+
+	def __len__(self):
+		return len(self.results)
+
+
+	def lookup(self, row, column, lefttype, righttype):
+		"""
+		Finds the best parameters for a pair of targets. If the pair was not optimized before, the nearest pair is used. The distance is the sum of the differences of the target numbers (i.e. the order in the model). Previous targets that are not part of the new model are not used as neighbours.
+
+		:param row: The name of the left objective
+		:param column: The name of the right objective
+		:param lefttype: The tuple of names of all left objectives (reactions or metabolites) of the model
+		:param righttype: The tuple of names of all right objectives of the model
+		:returns: A dictionary {parameter name: value} or None if no previous result is available
+		"""
+
+		if (row, column) in self.results:
+			return self.results[(row, column)]['parameters']
+
+		best = None
+		for (prevRow, prevColumn), result in self.results.items():
+			if prevRow not in lefttype or prevColumn not in righttype:
+				continue
+			distance = abs(lefttype.index(prevRow) - lefttype.index(row)) + abs(righttype.index(prevColumn) - righttype.index(column))
+			if best is None or distance < best[0]:
+				best = (distance, result['parameters'])
+
+		return best[1] if best is not None else None
+
 
 class Copasi:
 	"""
@@ -116,6 +444,85 @@ class Copasi:
 		return filename
 
 
+	def bulkWriter(self, workers = 8, shardLevels = 0, manifest = None, keyNames = ('row', 'column')):
+		"""
+		Creates a BulkWriter to save many variants of this Copasi file in parallel. Use it like this:
+
+		writer = copasi.bulkWriter(shardLevels = 1, manifest = 'manifest.tsv')
+		cpsFile = writer.path('myModel_R1_R2.cps')
+		copasi.setReportFileName(...)
+		writer.write(cpsFile, copasi.content, ('R1', 'R2'))
+		writer.close()
+
+		:param workers: Number of threads that write files
+		:param shardLevels: Number of levels of hashed subdirectories. 0 writes the files where they are named
+		:param manifest: File name of the manifest or None for no manifest
+		:param keyNames: Column names of the keys in the manifest
+		:returns: A BulkWriter object
+		"""
+
+		return BulkWriter(workers, shardLevels, manifest, keyNames, errorReport = self._errorReport)
+
+
+	def slimModel(self, keepTasks = ()):
+		"""
+		Removes everything from the Copasi file that CopasiSE does not need to run the scheduled tasks: layouts, plots, annotations, comments, the SBML reference, unscheduled tasks that are not used by the kept tasks (e.g. as subtask) and reports that are not used by the kept tasks. CopasiSE has to read every generated variant again, so this should be done once before the variants are generated.
+
+		:param keepTasks: Names of unscheduled tasks that shall be kept anyway, e.g. a subtask that is set later
+		:returns: A dictionary {part: number of removed bytes}
+		"""
+
+		size = lambda text: len(text.encode('utf-8'))
+		saved = {}
+
+		# These parts are only used by the graphical user interface or for SBML export
+		toRemove = (
+			('layouts', r'\s*<ListOfLayouts[\S\s]*?</ListOfLayouts>'),
+			('plots', r'\s*<ListOfPlots>[\S\s]*?</ListOfPlots>'),
+			('annotations', r'\s*<MiriamAnnotation>[\S\s]*?</MiriamAnnotation>'),
+			('comments', r'\s*<Comment>[\S\s]*?</Comment>'),
+			('sbml reference', r'\s*(?:<SBMLReference[^>]*/>|<SBMLReference[\S\s]*?</SBMLReference>)'),
+		)
+		for part, toSearch in toRemove:
+			before = size(self.content)
+			self.content = re.sub(toSearch, '', self.content)
+			saved[part] = before - size(self.content)
+
+		# Tasks and reports are only removed if nothing that is kept refers to them
+		taskSearch = r'[ \t]*<Task key="([^"]+)" name="([^"]+)"[^>]*[^/>]>[\S\s]*?</Task>\n?'
+		reportSearch = r'[ \t]*<Report key="([^"]+)"[^>]*[^/>]>[\S\s]*?</Report>\n?'
+		tasks = {match.group(1): (match.group(2), match.group(0)) for match in re.finditer(taskSearch, self.content)}
+		reports = {match.group(1): match.group(0) for match in re.finditer(reportSearch, self.content)}
+
+		keep = {key for key, (name, text) in tasks.items() if 'scheduled="true"' in text.split('>', 1)[0] or name in keepTasks}
+		if not keep:
+			self._errorReport('No scheduled task found. Tasks and reports are not slimmed.')
+			saved['tasks'] = saved['reports'] = 0
+			return saved
+
+		# Tasks refer to other tasks by key (e.g. "Task_14") or by name (e.g. "TaskList[Steady-State]") and to reports by key. Reports may refer to tasks by name.
+		keepReports = set()
+		while True:
+			text = ''.join(tasks[key][1] for key in keep) + ''.join(reports[key] for key in keepReports)
+			names = {re.sub(r'\\(.)', r'\1', name) for name in re.findall(r'TaskList\[((?:[^\]\\]|\\.)+)\]', text)}
+			keys = set(re.findall(r'\b((?:Task|Report)_\d+)\b', text))
+			newKeep = keep | {key for key, (name, _) in tasks.items() if key in keys or name in names}
+			newKeepReports = keepReports | (keys & set(reports))
+			if newKeep == keep and newKeepReports == keepReports:
+				break
+			keep, keepReports = newKeep, newKeepReports
+
+		before = size(self.content)
+		self.content = re.sub(taskSearch, lambda match: match.group(0) if match.group(1) in keep else '', self.content)
+		saved['tasks'] = before - size(self.content)
+
+		before = size(self.content)
+		self.content = re.sub(reportSearch, lambda match: match.group(0) if match.group(1) in keepReports else '', self.content)
+		saved['reports'] = before - size(self.content)
+
+		return saved
+
+
 	def checkCopasiSE(self, copasiPath):
 		"""
 		Checks whether a given CopasiSE program exists and if it is the right version. If a program defined by the user is not existing, the standard names in the $PATH are checked (i.e. copasise and CopasiSE).
@@ -144,20 +551,39 @@ class Copasi:
 		return copasiPath
 
 
-	def parallelCopasi(self, fileList, copasiPath = 'copasise', maxParallelJobs = 0, evalExitCode = True):
+	def parallelCopasi(self, fileList, copasiPath = 'copasise', maxParallelJobs = 0, evalExitCode = True, timeout = None, speculative = None, memoryAware = False, statusFile = None, promFile = None, chunkSize = None, scratchDir = None):
 		"""
-		Execute CopasiSE in parallel with a given list of files. This function requires GNU parallel!
+		Execute CopasiSE in parallel with a given list of files. This function requires GNU parallel, unless a timeout, speculative execution, memory-aware execution, chunks or a progress report is requested. In this case, the jobs are run by the CopasiExecutor (or the ChunkedCopasiExecutor).
 
 		:param fileList: The list of Copasi files as strings that shall be executed
 		:param copasiPath: Path to CopasiSE or it's name in the PATH variable. Defaults to 'copasise'
-		:param maxParallelJobs: Maximum number of jobs to execute in parallel. Defaults to the number of cores (incl. hyperthreading)
+		:param maxParallelJobs: Maximum number of jobs to execute in parallel. Defaults to the number of CPUs usable by this process (incl. hyperthreading, limited by cgroup quota and CPU affinity)
 		:param evalExitCode: When True, this script waits for CopasiSE to exit and gives notice. If false, this scripts starts CopasiSE in independet process(es) and exits.
+		:param timeout: Wall-clock limit in seconds for each job. Jobs running longer are killed and recorded. Defaults to None (no limit)
+		:param speculative: Percentile (0-100) of observed runtimes. Jobs running longer are started a second time with a different seed on idle slots, the first copy to finish is kept. Defaults to None (no speculative execution)
+		:param memoryAware: When True, new jobs are only started if the available memory (incl. cgroup limits) suffices for the observed memory usage per job. Defaults to False
+		:param statusFile: Path of a JSON file that is periodically updated with the progress of the jobs. Defaults to None (no file)
+		:param promFile: Path of a Prometheus textfile (*.prom) that is periodically updated with the progress of the jobs. Defaults to None (no file)
+		:param chunkSize: Number of files each worker slot stages in a local scratch directory and runs back to back, or 'auto' to tune it from the observed runtimes. Reports are copied back in one batch per chunk. Meant for many short jobs on shared file systems. Speculative and memory-aware execution are not available with chunks. Defaults to None (no chunks)
+		:param scratchDir: Directory to stage chunks in. Defaults to /dev/shm, if available, else the temporary directory of the system
 		"""
 
 		copasiPath = self.checkCopasiSE(copasiPath)
 
+		# Without a given number, use every CPU we may use. Inside containers, this may be much less than the number of cores of the host.
+		if maxParallelJobs == 0:
+			maxParallelJobs = effectiveCpuCount()
+
 		if len(fileList) > 0:
-			if evalExitCode:
+			if timeout is not None or speculative is not None or memoryAware or statusFile is not None or promFile is not None or chunkSize is not None:
+				if not evalExitCode:
+					self._errorReport('Timeouts, speculative and memory-aware execution, chunks and progress reports need to supervise CopasiSE. Waiting for CopasiSE to exit.')
+				# Runs all jobs under supervision, waits until they are finished and evaluates the results
+				startTime = datetime.now()
+				executor = self._executor(copasiPath, maxParallelJobs, timeout, speculative, memoryAware, statusFile, promFile, chunkSize = chunkSize, scratchDir = scratchDir)
+				results = executor.run(fileList)
+				self._notify(executor.exitCode(results), fileList, startTime, results)
+			elif evalExitCode:
 				# Starts parallel, waits until it's finished and evaluates the exit code
 				startTime = datetime.now()
 				self._notify(subprocess.call("parallel -j {} {} '>>' copasiOut.txt '2>&1' ::: {}".format(maxParallelJobs, copasiPath, ' '.join(fileList)), shell=True), fileList, startTime)
@@ -168,6 +594,135 @@ class Copasi:
 			self._errorReport('No file found to execute.')
 
 
+	def pipelineCopasi(self, variants, copasiPath = 'copasise', maxParallelJobs = 0, queueSize = 0, deleteInputs = False, manifest = None, keyNames = ('row', 'column'), timeout = None, speculative = None, memoryAware = False, statusFile = None, promFile = None, chunkSize = None, scratchDir = None):
+		"""
+		Execute CopasiSE in parallel on variants while they are generated. A thread writes the variants to disk and hands them over to the CopasiExecutor through a bounded queue, so the first jobs start as soon as the first variant is ready and only a limited number of variants waits on disk.
+
+		:param variants: An iterable (e.g. a generator) of tuples (filename, content) or (filename, content, key), see generateVariants() in updateMCAOptimizationTarget.py
+		:param copasiPath: Path to CopasiSE or it's name in the PATH variable. Defaults to 'copasise'
+		:param maxParallelJobs: Maximum number of jobs to execute in parallel. Defaults to the number of CPUs usable by this process
+		:param queueSize: Maximum number of written variants that wait for execution. Defaults to twice the number of parallel jobs
+		:param deleteInputs: When True, the Copasi file of a variant is deleted as soon as its job finished successfully. Defaults to False
+		:param manifest: File name of a manifest that maps the keys of the variants to their files or None for no manifest
+		:param keyNames: Column names of the keys in the manifest
+		:param timeout: Wall-clock limit in seconds for each job (see parallelCopasi())
+		:param speculative: Percentile of observed runtimes for speculative execution (see parallelCopasi())
+		:param memoryAware: Memory-aware admission of new jobs (see parallelCopasi())
+		:param statusFile: Path of a JSON status file (see parallelCopasi())
+		:param promFile: Path of a Prometheus textfile (see parallelCopasi())
+		:param chunkSize: Number of files per chunk or 'auto' for chunked execution (see parallelCopasi()). Chunks are filled with the variants that are already written
+		:param scratchDir: Directory to stage chunks in (see parallelCopasi())
+		"""
+
+		copasiPath = self.checkCopasiSE(copasiPath)
+
+		if maxParallelJobs == 0:
+			maxParallelJobs = effectiveCpuCount()
+
+		jobs = queue.Queue(queueSize or 2 * maxParallelJobs)
+		fileList = []	# All written files for the notification
+		entries = []	# Lines of the manifest
+		errors = []		# Exceptions of the producer, including SystemExit of fatal errors
+
+		def produce():
+			try:
+				for variant in variants:
+					filename, content = variant[0], variant[1]
+					directory = os.path.dirname(filename)
+					if directory:
+						os.makedirs(directory, exist_ok=True)
+					with open(filename, 'w', encoding='utf-8') as f:
+						f.write(content)
+					fileList.append(filename)
+					if len(variant) > 2:
+						entries.append('\t'.join(tuple(variant[2]) + (filename,)))
+					jobs.put(filename)	# Blocks while the queue is full
+			except OSError as e:
+				self._errorReport('An OS Error was raised while writing an output file. No more variants are generated.\n{}'.format(e))
+			except BaseException as e:
+				# sys.exit() only ends this thread, so the exception is raised again in the main thread once the started jobs are done
+				errors.append(e)
+			finally:
+				jobs.put(None)
+
+		startTime = datetime.now()
+		producer = threading.Thread(target=produce, daemon=True)
+		producer.start()
+
+		executor = self._executor(copasiPath, maxParallelJobs, timeout, speculative, memoryAware, statusFile, promFile, deleteInputs, chunkSize, scratchDir)
+		results = executor.run(jobs)
+		producer.join()
+
+		if errors:
+			raise errors[0]
+
+		if manifest is not None:
+			try:
+				with open(manifest, 'w', encoding='utf-8') as f:
+					f.write('\t'.join(tuple(keyNames) + ('path',)) + '\n')
+					f.write('\n'.join(entries) + '\n')
+			except OSError as e:
+				self._errorReport('An OS Error was raised while writing the manifest.\n{}'.format(e))
+
+		if len(fileList) > 0:
+			self._notify(executor.exitCode(results), fileList, startTime, results)
+		else:
+			self._errorReport('No file found to execute.')
+
+
+	def distributeCopasi(self, fileList, address = ('localhost', 8642), heartbeatTimeout = 30, statusFile = None, promFile = None, token = None):
+		"""
+		Serve a given list of files to workers, possibly on other hosts, and wait until all reports are back. Workers are started with distributedCopasi.py and need CopasiSE on their host.
+
+		:param fileList: The list of Copasi files as strings that shall be executed
+		:param address: Tuple (host, port) to listen on. Defaults to port 8642 on localhost. Use ('', port) to listen on all interfaces
+		:param heartbeatTimeout: Seconds without heartbeat after which a job of a worker is requeued
+		:param statusFile: Path of a JSON file that is periodically updated with the progress of the jobs. Defaults to None (no file)
+		:param promFile: Path of a Prometheus textfile (*.prom) that is periodically updated with the progress of the jobs. Defaults to None (no file)
+		:param token: A shared secret workers have to send. Defaults to None (every worker is accepted)
+		"""
+
+		if len(fileList) > 0:
+			startTime = datetime.now()
+			results = Coordinator(fileList, address, heartbeatTimeout = heartbeatTimeout, progress = self._progressReporter(statusFile, promFile), errorReport = self._errorReport, token = token).run()
+			self._notify(int(any(result['status'] != 'finished' for result in results.values())), fileList, startTime, results)
+		else:
+			self._errorReport('No file found to execute.')
+
+
+	def _executor(self, copasiPath, maxParallelJobs, timeout, speculative, memoryAware, statusFile, promFile, deleteInputs = False, chunkSize = None, scratchDir = None):
+		"""
+		Creates the executor for parallelCopasi() and pipelineCopasi(): a ChunkedCopasiExecutor if a chunk size is given, a CopasiExecutor otherwise. See parallelCopasi() for the parameters.
+
+		:returns: A CopasiExecutor or ChunkedCopasiExecutor
+		"""
+
+		progress = self._progressReporter(statusFile, promFile)
+
+		if chunkSize is None:
+			return CopasiExecutor(copasiPath, maxParallelJobs, timeout = timeout, speculative = speculative, memoryAware = memoryAware, progress = progress, deleteInputs = deleteInputs, errorReport = self._errorReport)
+
+		if speculative is not None or memoryAware:
+			self._errorReport('Speculative and memory-aware execution are not available with chunks. Running without them.')
+
+		return ChunkedCopasiExecutor(copasiPath, maxParallelJobs, chunkSize, scratchDir, timeout = timeout, progress = progress, deleteInputs = deleteInputs, errorReport = self._errorReport)
+
+
+	def _progressReporter(self, statusFile, promFile):
+		"""
+		Creates a ProgressReporter for the scan of this Copasi file, if any status file is requested.
+
+		:param statusFile: Path of the JSON status file or None
+		:param promFile: Path of the Prometheus textfile or None
+		:returns: A ProgressReporter or None
+		"""
+
+		if statusFile is None and promFile is None:
+			return None
+
+		return ProgressReporter(statusFile, promFile, name = os.path.basename(os.path.splitext(self.filename)[0]))
+
+
 	def runCopasi(self, cpsFile, copasiPath = 'copasise'):
 		"""
 		Run Copasi with a given file. This function is intended to use on a computer or cluster with another Python script calling it with multiprocessing to allow for parallel excecution without GNU parallel.
@@ -181,7 +736,7 @@ class Copasi:
 		subprocess.call('{} {}'.format(copasiPath, cpsFile), shell=True)
 
 
-	def _notify(self, exitCode, fileList, startTime):
+	def _notify(self, exitCode, fileList, startTime, results = None):
 		"""
 		Give some sort of notification when CopasiSE is finished.
 		##### I don't know yet, what kind of notification is best. Writing to some file would be ok. An e-mail would be great, but I need access to some SMTP server to do that.
@@ -189,6 +744,7 @@ class Copasi:
 		:param exitCode: The exit code of the former programm call (usually CopasiSE)
 		:param fileList: The list of Copasi files as strings that were executed
 		:param startTime: A datetime object of the starting time of the process(es)
+		:param results: The results of a CopasiExecutor run or None. Files that did not finish successfully are listed separately
 		"""
 
 		# Get total wallclock time for execution.
@@ -202,7 +758,15 @@ class Copasi:
 		dirname = os.path.dirname(self.filename)
 		basename = os.path.basename(os.path.splitext(self.filename)[0])
 		with open(os.path.join(dirname,'AA_FINISHED_' + basename) , 'w') as f:
-			f.write('CopasiSE finished {} the following files in {}:\n\n{}\n\nNothing more to do.'.format(cpsError, str(totalTime), '\n'.join(fileList)))
+			f.write('CopasiSE finished {} the following files in {}:\n\n{}\n\n'.format(cpsError, str(totalTime), '\n'.join(fileList)))
+			if results is not None:
+				unfinished = ['{}\t{}\t{}'.format(cpsFile, result['status'], result['exitCode']) for cpsFile, result in sorted(results.items()) if result['status'] != 'finished']
+				speculative = sum(result['speculative'] for result in results.values())
+				if unfinished:
+					f.write('The following files did not finish successfully (file, status, exit code):\n\n{}\n\n'.format('\n'.join(unfinished)))
+				if speculative:
+					f.write('{} jobs were re-executed speculatively.\n\n'.format(speculative))
+			f.write('Nothing more to do.')
 
 
 	def turnToNumbers(self, mylist, referenceList):
@@ -430,30 +994,36 @@ class Copasi:
 
 
 
-	def setOptimizationMethod(self, method):
+	def setOptimizationMethod(self, method, generations = 200, population = 40, iterations = 2000, swarmSize = 50, stdDeviation = 1e-06, seed = 0):
 		"""
-		Sets the method for an optimization. Not all methods are available, yet. Only standard parameters will be set.
+		Sets the method for an optimization. Not all methods are available, yet. Parameters that are not given get standard values.
 
 		:param method: A string with the method. Choose from: EP, PS
+		:param generations: Number of generations (EP only). Defaults to 200
+		:param population: Population size (EP only). Defaults to 40
+		:param iterations: Iteration limit (PS only). Defaults to 2000
+		:param swarmSize: Swarm size (PS only). Defaults to 50
+		:param stdDeviation: Standard deviation of the swarm at which the search stops (PS only). Defaults to 1e-06
+		:param seed: Seed of the random number generator. Defaults to 0 (random seed)
 		"""
 
 		toSearch = r'<Task ([^n]+) name="Optimization"([\S\s]+?)<Method [\S\s]+?</Method>'
 
 		if method == 'EP':
 			toReplace = r'''<Task \1 name="Optimization"\2<Method name="Evolutionary Programming" type="EvolutionaryProgram">
-        <Parameter name="Number of Generations" type="unsignedInteger" value="200"/>
-        <Parameter name="Population Size" type="unsignedInteger" value="40"/>
+        <Parameter name="Number of Generations" type="unsignedInteger" value="{}"/>
+        <Parameter name="Population Size" type="unsignedInteger" value="{}"/>
         <Parameter name="Random Number Generator" type="unsignedInteger" value="1"/>
-        <Parameter name="Seed" type="unsignedInteger" value="0"/>
-      </Method>'''
+        <Parameter name="Seed" type="unsignedInteger" value="{}"/>
+      </Method>'''.format(int(generations), int(population), int(seed))
 		elif method == 'PS':
 			toReplace = r'''<Task \1 name="Optimization"\2<Method name="Particle Swarm" type="ParticleSwarm">
-        <Parameter name="Iteration Limit" type="unsignedInteger" value="2000"/>
-        <Parameter name="Swarm Size" type="unsignedInteger" value="50"/>
-        <Parameter name="Std. Deviation" type="unsignedFloat" value="1e-06"/>
+        <Parameter name="Iteration Limit" type="unsignedInteger" value="{}"/>
+        <Parameter name="Swarm Size" type="unsignedInteger" value="{}"/>
+        <Parameter name="Std. Deviation" type="unsignedFloat" value="{}"/>
         <Parameter name="Random Number Generator" type="unsignedInteger" value="1"/>
-        <Parameter name="Seed" type="unsignedInteger" value="0"/>
-      </Method>'''
+        <Parameter name="Seed" type="unsignedInteger" value="{}"/>
+      </Method>'''.format(int(iterations), int(swarmSize), stdDeviation, int(seed))
 		else:
 			self._errorReport('Optimization method {} not implemented'.format(method), fatal = True)
 
@@ -469,6 +1039,85 @@ class Copasi:
 		self.content = reBuffer[0]
 
 
+	def raceOptimizationMethods(self, candidates, targets, copasiPath = 'copasise', maxParallelJobs = 0, budget = 0.1, timeout = None):
+		"""
+		Runs every candidate optimization method with a reduced budget on a sample of MCA targets and sets the method that performed best. Within every target, the candidates are ranked by their objective function value (failed runs rank last). The winner has the best mean rank, ties are broken by fewer function evaluations. All modifications of the race are undone, only the method of the winner (with its full budget) is set.
+
+		:param candidates: A list of dictionaries with keyword arguments for setOptimizationMethod() (see parseMethodSpec())
+		:param targets: A list of tuples (objleft, objright) with the numbers of the MCA targets to race on
+		:param copasiPath: Path to CopasiSE or it's name in the PATH variable. Defaults to 'copasise'
+		:param maxParallelJobs: Maximum number of jobs to execute in parallel. Defaults to the number of CPUs usable by this process
+		:param budget: Factor for the iteration limits of the candidates during the race. Defaults to 0.1
+		:param timeout: Wall-clock limit in seconds for every run of the race. Runs exceeding it are killed and rank last. Defaults to None (no limit)
+		:returns: A tuple (winner, scores) with the winning candidate (None if all runs failed) and a list of (mean rank, function evaluations) in the order of the candidates
+		"""
+
+		if len(candidates) == 0 or len(targets) == 0:
+			self._errorReport('At least one candidate method and one target are needed for a race.', fatal = True)
+
+		copasiPath = self.checkCopasiSE(copasiPath)
+		original = self.content
+		maximize = self.isMaximization()
+
+		with tempfile.TemporaryDirectory(prefix='race_', dir=os.path.dirname(os.path.abspath(self.filename))) as raceDir:
+			fileList = []
+			for c, candidate in enumerate(candidates):
+				for t, (objleft, objright) in enumerate(targets):
+					self.setMCAOptiParameters(objleft, objright)
+					self.setTaskToMCA()
+					self.setOptimizationMethod(**candidate)
+					self.setOptimizationBudget({name: max(1, int(round(value * budget))) for name, value in self.getOptimizationBudget().items()})
+					# Copasi resolves relative report names from the directory of the Copasi file
+					self.setReportFileName('race_{}_{}.txt'.format(c, t))
+					# The directory of the model may contain characters that saveCopasiFile() would remove, so the race files are written directly
+					cpsFile = os.path.join(raceDir, 'race_{}_{}.cps'.format(c, t))
+					try:
+						with open(cpsFile, 'w', encoding='utf-8') as f:
+							f.write(self.content)
+					except OSError as e:
+						self.content = original
+						self._errorReport('An OS Error was raised while writing the files of the race.\n{}'.format(e), fatal = True)
+					fileList.append(cpsFile)
+
+			self.content = original
+			runs = CopasiExecutor(copasiPath, maxParallelJobs, timeout = timeout, errorReport = self._errorReport).run(fileList)
+
+			results = []	# results[candidate][target]
+			for c in range(len(candidates)):
+				results.append([])
+				for t in range(len(targets)):
+					# Killed runs may have written a partial report
+					report = os.path.join(raceDir, 'race_{}_{}.txt'.format(c, t))
+					finished = runs[fileList[c * len(targets) + t]]['status'] == 'finished'
+					results[c].append(readOptimizationReport(report) if finished and os.path.exists(report) else None)
+
+		# Rank the candidates within every target. Failed runs share the last rank.
+		ranks = [0.0] * len(candidates)
+		evaluations = [0.0] * len(candidates)
+		for t in range(len(targets)):
+			values = [results[c][t]['objective'] if results[c][t] is not None else None for c in range(len(candidates))]
+			for c, value in enumerate(values):
+				if value is None:
+					ranks[c] += len(candidates)
+					continue
+				better = sum(other is not None and (other > value if maximize else other < value) for other in values)
+				ranks[c] += better + 1
+				evaluations[c] += results[c][t]['evaluations'] or 0
+
+		scores = [(rank / len(targets), evaluations[c]) for c, rank in enumerate(ranks)]
+		if all(result is None for candidateResults in results for result in candidateResults):
+			winner = None
+		else:
+			winner = candidates[min(range(len(candidates)), key=lambda c: scores[c])]
+
+		if winner is None:
+			self._errorReport('No candidate of the race produced a result (see copasiOut.txt). The optimization method is not changed.')
+		else:
+			self.setOptimizationMethod(**winner)
+
+		return winner, scores
+
+
 	def setTaskToMCA(self):
 		"""
 		Sets the Optimization Task to MCA.
@@ -530,7 +1179,7 @@ class Copasi:
 		else:
 			toSearch = r'<Parameter name="LowerBound" type="cn" value="[^"]+"/>\s+<Parameter name="ObjectCN" type="cn" value="([^\[]+)\[' + name + r'\]([^"]+)Parameter=' + parameter + r'([^"]+)"/>\s+<Parameter name="StartValue" type="float" value="[^"]+"/>\s+<Parameter name="UpperBound" type="cn" value="[^"]+"/>'
 
-			toReplace = r'<Parameter name="LowerBound" type="cn" value="' + lower + r'"/>\n            <Parameter name="ObjectCN" type="cn" value="\1[' + name + r']\2Parameter=' + parameter + '\3"/>\n            <Parameter name="StartValue" type="float" value="' + start + r'"/>\n            <Parameter name="UpperBound" type="cn" value="' + upper + r'"/>'
+			toReplace = r'<Parameter name="LowerBound" type="cn" value="' + lower + r'"/>\n            <Parameter name="ObjectCN" type="cn" value="\1[' + name + r']\2Parameter=' + parameter + r'\3"/>\n            <Parameter name="StartValue" type="float" value="' + start + r'"/>\n            <Parameter name="UpperBound" type="cn" value="' + upper + r'"/>'
 
 		# subn returns a tupel: (new_string, number_of_subs_made)
 		reBuffer = re.subn(toSearch, toReplace, self.content)
@@ -544,6 +1193,121 @@ class Copasi:
 		self.content = reBuffer[0]
 
 
+	def getOptimizationItems(self):
+		"""
+		Extracts all optimization items.
+
+		:returns: A list of dictionaries {'name': str, 'parameter': str or None, 'lower': str, 'start': str, 'upper': str, 'objectCN': str} in the order of the Copasi file. For items of reactions, 'parameter' is the name of the reaction parameter.
+		"""
+
+		items = []
+		for reResult in re.finditer(r'<ParameterGroup name="OptimizationItem">\s+<Parameter name="LowerBound" type="cn" value="([^"]+)"/>\s+<Parameter name="ObjectCN" type="cn" value="([^"]+)"/>\s+<Parameter name="StartValue" type="float" value="([^"]+)"/>\s+<Parameter name="UpperBound" type="cn" value="([^"]+)"/>', self.content):
+			objectCN = reResult.group(2)
+			nameResult = re.search(r'Vector=[^\[]+\[([^\]]+)\]', objectCN)
+			if nameResult is None:
+				self._errorReport('The optimization item {} could not be interpreted.'.format(objectCN))
+				continue
+			parameterResult = re.search(r',Parameter=([^,]+)', objectCN)
+			items.append({'name': nameResult.group(1), 'parameter': parameterResult.group(1) if parameterResult is not None and 'Vector=Reactions[' in objectCN else None, 'lower': reResult.group(1), 'start': reResult.group(3), 'upper': reResult.group(4), 'objectCN': objectCN})
+
+		return items
+
+
+	def setOptimizationStartValues(self, values, items = None):
+		"""
+		Sets the start values of all optimization items, e.g. to the best parameters of a previous optimization (see WarmStart). Values are matched by the names Copasi uses in optimization reports, i.e. »Values[NAME]« for global quantities and »(REACTION).PARAMETER« for reaction parameters. Values outside of numeric bounds are moved to the bounds. Items without value get their original start value.
+
+		:param values: A dictionary {report name: value}
+		:param items: The optimization items with their original start values (see getOptimizationItems()). Defaults to the current items
+		:returns: The number of items that got a value from values
+		"""
+
+		if items is None:
+			items = self.getOptimizationItems()
+
+		found = 0
+		starts = {}		# ObjectCN -> new start value
+		for item in items:
+			if item['parameter'] is None:
+				names = ('Values[{}]'.format(item['name']), 'Compartments[{}]'.format(item['name']), item['name'])
+			else:
+				names = ('({}).{}'.format(item['name'], item['parameter']),)
+
+			start = item['start']
+			for reportName, value in values.items():
+				# Report names may carry a reference, e.g. »Values[k1].InitialValue«
+				if any(reportName == name or reportName.startswith(name + '.') for name in names):
+					try:
+						value = max(value, float(item['lower']))
+					except ValueError:	# Bounds may also be references to other objects
+						pass
+					try:
+						value = min(value, float(item['upper']))
+					except ValueError:
+						pass
+					start = repr(float(value))
+					found += 1
+					break
+
+			starts[item['objectCN']] = start
+
+		# All items are changed in a single pass through the file
+		def _replace(match):
+			start = starts.get(match.group(2))
+			return match.group(0) if start is None else match.group(1) + match.group(2) + match.group(3) + start + '"'
+
+		self.content = re.sub(r'(<Parameter name="ObjectCN" type="cn" value=")([^"]+)("/>\s+<Parameter name="StartValue" type="float" value=")[^"]+"', _replace, self.content)
+
+		return found
+
+
+	def getOptimizationBudget(self):
+		"""
+		Extracts the iteration limits of the optimization method (e.g. »Number of Generations« for Evolutionary Programming or »Iteration Limit« for Particle Swarm).
+
+		:returns: A dictionary {parameter name: int}
+		"""
+
+		reResult = re.search(r'<Task [^>]+ name="Optimization"[\S\s]+?(<Method [\S\s]+?</Method>)', self.content)
+		if reResult is None:
+			self._errorReport('The optimization method could not be found.', fatal = True)
+
+		return {name: int(value) for name, value in re.findall(r'<Parameter name="(Number of Generations|Iteration Limit|Number of Iterations)" type="unsignedInteger" value="(\d+)"/>', reResult.group(1))}
+
+
+	def setOptimizationBudget(self, budget):
+		"""
+		Sets iteration limits of the optimization method.
+
+		:param budget: A dictionary {parameter name: int} (see getOptimizationBudget())
+		"""
+
+		def _replace(match):
+			method = match.group(2)
+			for name, value in budget.items():
+				method = re.sub(r'(<Parameter name="' + re.escape(name) + r'" type="unsignedInteger" value=")\d+("/>)', r'\g<1>' + str(int(value)) + r'\g<2>', method)
+			return match.group(1) + method
+
+		# subn returns a tupel: (new_string, number_of_subs_made)
+		reBuffer = re.subn(r'(<Task [^>]+ name="Optimization"[\S\s]+?)(<Method [\S\s]+?</Method>)', _replace, self.content)
+		# If no replacement was made, abort.
+		if reBuffer[1] == 0:
+			self._errorReport('The optimization budget could not be set.', fatal = True)
+
+		self.content = reBuffer[0]
+
+
+	def isMaximization(self):
+		"""
+		Determines whether the optimization maximizes or minimizes the target.
+
+		:returns: True for maximization, False for minimization
+		"""
+
+		reResult = re.search(r'<Parameter name="Maximize" type="bool" value="(\d)"/>', self.content)
+		return reResult is not None and reResult.group(1) == '1'
+
+
 	def delOptimizationItem(self, name, parameter = None):
 		"""
 		Deletes an optimization item.
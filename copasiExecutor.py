@@ -0,0 +1,1090 @@
+#!/usr/bin/env python3
+
+import os						# To kill process groups and handle files
+import re						# Regular expressions
+import shlex					# To split the CopasiSE command safely
+import signal					# To kill stuck CopasiSE processes
+import subprocess				# To start CopasiSE
+import random					# To draw new seeds for speculative copies
+import time						# For wall-clock measurements and polling
+import sys						# For stderr printing
+import math						# To round CPU quotas up
+import json						# For the status file
+import queue					# Jobs of a pipeline arrive through a queue
+import threading				# Worker slots of chunked execution
+import shutil					# To copy staged reports back
+import tempfile					# For the scratch directories of chunked execution
+from collections import deque	# Queue of waiting jobs
+from datetime import datetime	# To get a feeling of time
+
+
+def _readCgroupFile(controller, name):
+	"""
+	Reads a file of the cgroup this process belongs to. Both cgroup v2 (unified) and v1 hierarchies are supported. Inside containers, the cgroup path of /proc/self/cgroup usually does not exist in the mounted hierarchy, so the root of the mount is used as a fallback.
+
+	:param controller: The cgroup v1 controller (e.g. 'cpu' or 'memory') or None for cgroup v2
+	:param name: The name of the file (e.g. 'cpu.max')
+	:returns: The stripped content of the file or None if it could not be read
+	"""
+
+	mount = '/sys/fs/cgroup' if controller is None else os.path.join('/sys/fs/cgroup', controller)
+	paths = []
+	try:
+		with open('/proc/self/cgroup', 'r') as f:
+			for line in f:
+				hierarchy, controllers, path = line.strip().split(':', 2)
+				if (controller is None and hierarchy == '0') or controller in controllers.split(','):
+					paths.append(os.path.join(mount, path.lstrip('/'), name))
+	except (OSError, ValueError):
+		pass
+	paths.append(os.path.join(mount, name))
+
+	for path in paths:
+		try:
+			with open(path, 'r') as f:
+				return f.read().strip()
+		except OSError:
+			continue
+
+	return None
+
+
+def effectiveCpuCount():
+	"""
+	Determines how many CPUs this process can actually use. This is the minimum of the CPUs in the affinity mask and the CPU quota of the cgroup (v1 or v2), rounded up.
+
+	:returns: The number of usable CPUs (at least 1)
+	"""
+
+	try:
+		cpus = len(os.sched_getaffinity(0))
+	except AttributeError:		# Not available on all platforms
+		cpus = os.cpu_count() or 1
+
+	quota = None
+	# cgroup v2: »max 100000« or »200000 100000«
+	cpuMax = _readCgroupFile(None, 'cpu.max')
+	if cpuMax is not None and not cpuMax.startswith('max'):
+		try:
+			limit, period = cpuMax.split()
+			quota = int(limit) / int(period)
+		except ValueError:
+			pass
+	# cgroup v1: a quota of -1 means no limit
+	if quota is None:
+		limit = _readCgroupFile('cpu', 'cpu.cfs_quota_us')
+		period = _readCgroupFile('cpu', 'cpu.cfs_period_us')
+		try:
+			if int(limit) > 0 and int(period) > 0:
+				quota = int(limit) / int(period)
+		except (TypeError, ValueError):
+			pass
+
+	if quota is not None:
+		cpus = min(cpus, math.ceil(quota))
+
+	return max(cpus, 1)
+
+
+def availableMemory():
+	"""
+	Determines how much memory new processes can still allocate. This is the minimum of MemAvailable of the system and the remaining memory of the cgroup (v1 or v2). Reclaimable page cache is not counted as used memory of the cgroup.
+
+	:returns: The available memory in bytes or None if it could not be determined
+	"""
+
+	available = None
+	try:
+		with open('/proc/meminfo', 'r') as f:
+			for line in f:
+				if line.startswith('MemAvailable:'):
+					available = int(line.split()[1]) * 1024
+					break
+	except (OSError, ValueError):
+		pass
+
+	# cgroup v2 first, then v1. Unlimited cgroups report »max« (v2) or a huge number (v1)
+	for controller, limitName, usageName, inactiveName in ((None, 'memory.max', 'memory.current', 'inactive_file'), ('memory', 'memory.limit_in_bytes', 'memory.usage_in_bytes', 'total_inactive_file')):
+		limit = _readCgroupFile(controller, limitName)
+		usage = _readCgroupFile(controller, usageName)
+		try:
+			limit = int(limit)
+			usage = int(usage)
+		except (TypeError, ValueError):
+			continue
+
+		stat = _readCgroupFile(controller, 'memory.stat') or ''
+		for line in stat.split('\n'):
+			if line.startswith(inactiveName + ' '):
+				usage -= int(line.split()[1])
+				break
+
+		remaining = max(limit - usage, 0)
+		if available is None or remaining < available:
+			available = remaining
+		break
+
+	return available
+
+
+def _processMemory(pid):
+	"""
+	Reads the resident set size of a process.
+
+	:param pid: The process id
+	:returns: The current RSS in bytes or 0 if the process is gone
+	"""
+
+	try:
+		with open('/proc/{}/status'.format(pid), 'r') as f:
+			for line in f:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1]) * 1024
+	except (OSError, ValueError):
+		pass
+
+	return 0
+
+
+def reportTargets(cpsFile, content = None):
+	"""
+	Finds the report files a Copasi file writes to. CopasiSE resolves relative targets against the directory of the Copasi file.
+
+	:param cpsFile: The Copasi file
+	:param content: The content of the Copasi file, if it is already loaded. Otherwise, the file is read
+	:returns: A list of report paths
+	"""
+
+	if content is None:
+		with open(cpsFile, 'r', encoding='utf-8') as f:
+			content = f.read()
+
+	return [os.path.join(os.path.dirname(cpsFile), target) for target in re.findall('target="([^"]+)"', content)]
+
+
+def defaultScratchDir():
+	"""
+	Chooses a local directory to stage Copasi files in. /dev/shm is a tmpfs on most Linux systems, so staged files never touch a disk. Otherwise, the temporary directory of the system ($TMPDIR or /tmp) is used.
+
+	:returns: The path of the scratch directory
+	"""
+
+	if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK | os.X_OK):
+		return '/dev/shm'
+
+	return tempfile.gettempdir()
+
+
+def parseChunkSize(value):
+	"""
+	Turns a chunk size given as string into a number or 'auto'. Can be used as type for argparse.
+
+	:param value: A positive number or 'auto'
+	:returns: The chunk size as int or 'auto'
+	:raises ValueError: If the value is neither 'auto' nor a positive number
+	"""
+
+	if value == 'auto':
+		return value
+
+	size = int(value)
+	if size < 1:
+		raise ValueError('The chunk size must be at least 1.')
+
+	return size
+
+
+def _processCpuTime(pid):
+	"""
+	Reads the CPU time (user and system) a running process has used so far.
+
+	:param pid: The process id
+	:returns: The CPU time in seconds or 0 if the process is gone
+	"""
+
+	try:
+		with open('/proc/{}/stat'.format(pid), 'r') as f:
+			# The process name may contain spaces, so fields are counted from its closing bracket
+			fields = f.read().rpartition(')')[2].split()
+		return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+	except (OSError, ValueError, IndexError):
+		return 0
+
+
+class ProgressReporter:
+	"""
+	Writes the progress of a running scan periodically to a JSON status file and/or a Prometheus textfile (e.g. for the textfile collector of the node exporter). Both files are replaced atomically, so readers never see partial files.
+	"""
+
+	def __init__(self, statusFile = None, promFile = None, interval = 10, window = 60, name = 'copasi', capacity = None):
+		"""
+		:param statusFile: Path of the JSON status file or None
+		:param promFile: Path of the Prometheus textfile or None. The node exporter only reads files ending with .prom
+		:param interval: Minimum number of seconds between two writes
+		:param window: Length in seconds of the moving window for throughput and ETA
+		:param name: Name of the scan, used as label "scan" in the Prometheus metrics
+		:param capacity: Number of CPUs the utilisation refers to. Defaults to effectiveCpuCount()
+		"""
+
+		self.statusFile = statusFile
+		self.promFile = promFile
+		self.interval = interval
+		self.window = window
+		self.name = name
+		self.capacity = capacity or effectiveCpuCount()
+
+		self.startTime = time.monotonic()
+		self.lastWrite = None
+		self.lastCpu = None			# (wall-clock time, CPU seconds) of the last write
+		self.finishTimes = deque()	# Times of the jobs finished within the window
+
+
+	def jobFinished(self):
+		"""
+		Notes that a job has finished (successfully or not).
+		"""
+
+		self.finishTimes.append(time.monotonic())
+
+
+	def due(self, force = False):
+		"""
+		Checks whether update() would write now. Callers use it to skip collecting expensive values (e.g. CPU times from /proc) between two writes.
+
+		:param force: Write regardless of the interval
+		:returns: True if the interval has passed since the last write or force is True
+		"""
+
+		return force or self.lastWrite is None or time.monotonic() - self.lastWrite >= self.interval
+
+
+	def update(self, completed, failed, running, pending, cpuSeconds = None, force = False):
+		"""
+		Writes the status files, if the interval has passed since the last write.
+
+		:param completed: Number of successfully finished jobs
+		:param failed: Number of failed or timed out jobs
+		:param running: Number of running jobs
+		:param pending: Number of waiting jobs or None if it is not known yet
+		:param cpuSeconds: CPU time all jobs have used so far or None if it is unknown
+		:param force: Write regardless of the interval (e.g. at the end of a scan)
+		"""
+
+		if not self.due(force):
+			return
+
+		now = time.monotonic()
+
+		while self.finishTimes and now - self.finishTimes[0] > self.window:
+			self.finishTimes.popleft()
+
+		elapsed = now - self.startTime
+		windowRate = len(self.finishTimes) / min(self.window, elapsed) if elapsed > 0 else 0.0
+		if pending is None:
+			eta = None
+		elif running + pending == 0:
+			eta = 0.0
+		else:
+			eta = (running + pending) / windowRate if windowRate > 0 else None
+
+		utilisation = None
+		if cpuSeconds is not None:
+			if self.lastCpu is not None and now > self.lastCpu[0]:
+				utilisation = (cpuSeconds - self.lastCpu[1]) / ((now - self.lastCpu[0]) * self.capacity)
+			self.lastCpu = (now, cpuSeconds)
+
+		status = {
+			'scan': self.name,
+			'timestamp': time.time(),
+			'elapsed': elapsed,
+			'completed': completed,
+			'failed': failed,
+			'running': running,
+			'pending': pending,
+			'total': completed + failed + running + pending if pending is not None else None,
+			'jobsPerSecond': (completed + failed) / elapsed if elapsed > 0 else 0.0,
+			'jobsPerSecondWindow': windowRate,
+			'eta': eta,
+			'cpuSeconds': cpuSeconds,
+			'cpuUtilisation': utilisation,
+			'cpuCapacity': self.capacity,
+		}
+
+		if self.statusFile is not None:
+			self._writeAtomic(self.statusFile, json.dumps(status, indent=2) + '\n')
+		if self.promFile is not None:
+			self._writeAtomic(self.promFile, self._prometheus(status))
+
+		self.lastWrite = now
+
+
+	def _prometheus(self, status):
+		"""
+		Formats a status in the Prometheus text exposition format. Unknown values are left out.
+
+		:param status: The status dictionary of update()
+		:returns: The content of the textfile
+		"""
+
+		metrics = (
+			('copasi_jobs_completed_total', 'counter', 'Successfully finished CopasiSE jobs.', status['completed']),
+			('copasi_jobs_failed_total', 'counter', 'Failed or timed out CopasiSE jobs.', status['failed']),
+			('copasi_jobs_running', 'gauge', 'Running CopasiSE jobs.', status['running']),
+			('copasi_jobs_pending', 'gauge', 'Waiting CopasiSE jobs.', status['pending']),
+			('copasi_jobs_per_second', 'gauge', 'Finished jobs per second within the moving window.', status['jobsPerSecondWindow']),
+			('copasi_eta_seconds', 'gauge', 'Estimated seconds until the scan is finished.', status['eta']),
+			('copasi_cpu_seconds_total', 'counter', 'CPU time used by CopasiSE jobs.', status['cpuSeconds']),
+			('copasi_cpu_utilisation_ratio', 'gauge', 'CPU utilisation of the usable CPUs since the last update.', status['cpuUtilisation']),
+			('copasi_last_update_timestamp_seconds', 'gauge', 'Time of the last update.', status['timestamp']),
+		)
+
+		label = '{{scan="{}"}}'.format(self.name.replace('\\', '\\\\').replace('"', '\\"'))
+		lines = []
+		for metric, metricType, description, value in metrics:
+			if value is None:
+				continue
+			lines.append('# HELP {} {}'.format(metric, description))
+			lines.append('# TYPE {} {}'.format(metric, metricType))
+			lines.append('{}{} {}'.format(metric, label, value))
+
+		return '\n'.join(lines) + '\n'
+
+
+	def _writeAtomic(self, filename, content):
+		"""
+		Writes a file via a temporary file in the same directory and renames it.
+
+		:param filename: The file to write
+		:param content: The new content
+		"""
+
+		tmpFile = os.path.join(os.path.dirname(filename), '.' + os.path.basename(filename) + '.tmp')
+		try:
+			with open(tmpFile, 'w') as f:
+				f.write(content)
+			os.replace(tmpFile, filename)
+		except OSError as e:
+			print('{} ProgressReporter: Could not write {}.\n{} - Continuing.'.format(datetime.now().strftime('%c'), filename, e), file=sys.stderr)
+
+
+class _Job:
+	"""
+	A single running CopasiSE process. A speculative copy of a job is linked to its original via `twin`.
+	"""
+
+	def __init__(self, cpsFile, proc, startTime, original = None):
+		self.cpsFile = cpsFile
+		self.proc = proc
+		self.startTime = startTime
+		self.original = original	# None for original jobs, the original _Job for speculative copies
+		self.twin = None			# The speculative copy of an original job (or the original of a copy)
+		self.rss = 0				# Last observed resident set size in bytes
+		self.peakRSS = 0			# Highest observed resident set size in bytes
+
+
+class CopasiExecutor:
+	"""
+	Runs CopasiSE on a list of Copasi files in parallel without GNU parallel. In addition to plain parallel execution, each job can be limited in wall-clock time and stragglers can be re-executed speculatively with a different seed.
+	"""
+
+	def __init__(self, copasiPath, maxParallelJobs = 0, timeout = None, speculative = None, memoryAware = False, memorySafety = 1.2, progress = None, deleteInputs = False, logFile = 'copasiOut.txt', pollInterval = 0.2, minSamples = 5, errorReport = None):
+		"""
+		:param copasiPath: Path to CopasiSE or it's name in the PATH variable
+		:param maxParallelJobs: Maximum number of jobs to execute in parallel. 0 means one job per usable CPU (see effectiveCpuCount())
+		:param timeout: Wall-clock limit in seconds for each job or None for no limit. Jobs exceeding the limit are killed and recorded as timed out
+		:param speculative: Percentile (0-100) of the observed runtimes after which a still running job is started a second time with a different seed on an idle slot. None disables speculative execution
+		:param memoryAware: If True, new jobs are only started if the available memory (see availableMemory()) suffices for the observed memory usage of a job
+		:param memorySafety: Factor applied to the expected memory usage of a new job before it is compared to the available memory
+		:param progress: A ProgressReporter that receives the progress of the jobs or None
+		:param deleteInputs: If True, the Copasi file of a successfully finished job is deleted (the report is kept)
+		:param logFile: File to which stdout and stderr of CopasiSE are appended
+		:param pollInterval: Seconds between two checks of the running processes
+		:param minSamples: Number of finished jobs needed before speculative copies are started
+		:param errorReport: Function to report errors with (e.g. Copasi._errorReport). Defaults to printing to stderr
+		"""
+
+		self.copasiCommand = shlex.split(copasiPath)
+		self.maxParallelJobs = maxParallelJobs if maxParallelJobs > 0 else effectiveCpuCount()
+		self.timeout = timeout
+		self.speculative = speculative
+		self.memoryAware = memoryAware
+		self.memorySafety = memorySafety
+		self.observedRSS = 0		# Highest RSS of any job so far, used as the expected RSS of new jobs
+		self.throttled = False		# Whether a memory throttling was already reported
+		self.unmeasured = False		# Whether a job finished without any memory measurement
+		self.progress = progress
+		self.deleteInputs = deleteInputs
+		self.logFile = logFile
+		self.pollInterval = pollInterval
+		self.minSamples = minSamples
+		if errorReport is None:
+			errorReport = self._errorReport
+		self.errorReport = errorReport
+
+
+	def _errorReport(self, text, fatal = False):
+		"""
+		Reports errors and aborts if the error is fatal.
+
+		:param text: String to be printed
+		:param fatal: Boolean to state whether the error is fatal
+		"""
+
+		textend = ('Continuing.', 'Aborting.')
+
+		print('{} CopasiExecutor: {} - {}'.format(datetime.now().strftime('%c'), text, textend[fatal]), file=sys.stderr)
+		if fatal:
+			sys.exit(1)
+
+
+	def run(self, fileList):
+		"""
+		Executes CopasiSE for every file in fileList and waits until all jobs are finished, timed out or failed.
+
+		:param fileList: The list of Copasi files as strings that shall be executed or a queue.Queue that delivers Copasi files as soon as they are ready and None after the last one (see Copasi.pipelineCopasi())
+		:returns: A dictionary in the form {cpsFile: {'status': 'finished'|'failed'|'timeout', 'exitCode': int or None, 'runtime': seconds, 'speculative': bool}}
+		"""
+
+		if isinstance(fileList, queue.Queue):
+			source = fileList
+			pending = deque()
+		else:
+			source = None
+			pending = deque(fileList)
+		running = []		# All running _Job objects, originals and speculative copies
+		runtimes = []		# Runtimes of all successfully finished jobs for the speculation threshold
+		results = {}
+		cpuStart = os.times()	# CPU time of children is only counted once they are reaped, so earlier children are excluded
+
+		with open(self.logFile, 'a') as log:
+			try:
+				while pending or running or source is not None:
+					now = time.monotonic()
+					finished = len(results)
+
+					for job in list(running):
+						if job not in running:	# Already removed together with its twin
+							continue
+
+						if self.memoryAware:
+							job.rss = _processMemory(job.proc.pid)
+							job.peakRSS = max(job.peakRSS, job.rss)
+							self.observedRSS = max(self.observedRSS, job.peakRSS)
+
+						exitCode = self._poll(job)
+						original = job.original or job
+
+						if exitCode is None:
+							# Timeouts are measured from the start of the original job, so a speculative copy does not extend the limit. As long as both copies run, the original handles the timeout of both.
+							if self.timeout is not None and now - original.startTime > self.timeout and (job.original is None or job.twin is None):
+								self._kill(job, running)
+								if job.original is not None:
+									self._cleanDuplicate(job.cpsFile)
+								if job.twin is not None:
+									self._kill(job.twin, running)
+									self._cleanDuplicate(job.twin.cpsFile)
+								results[original.cpsFile] = {'status': 'timeout', 'exitCode': None, 'runtime': now - original.startTime, 'speculative': original is not job or job.twin is not None}
+								self.errorReport('{} exceeded the time limit of {} s and was killed.'.format(original.cpsFile, self.timeout))
+							continue
+
+						running.remove(job)
+						twin = job.twin
+
+						# If one copy failed, the other one may still succeed
+						if exitCode != 0 and twin is not None and twin in running:
+							twin.twin = None
+							if job.original is not None:
+								self._cleanDuplicate(job.cpsFile)
+							continue
+
+						if twin is not None and twin in running:
+							self._kill(twin, running)
+						if job.original is not None:
+							self._promoteDuplicate(job.cpsFile, original.cpsFile)
+						elif twin is not None:
+							self._cleanDuplicate(twin.cpsFile)
+
+						runtime = now - original.startTime
+						if exitCode == 0:
+							runtimes.append(now - job.startTime)
+							results[original.cpsFile] = {'status': 'finished', 'exitCode': 0, 'runtime': runtime, 'speculative': job.original is not None}
+							if self.deleteInputs:
+								os.remove(original.cpsFile)
+						else:
+							results[original.cpsFile] = {'status': 'failed', 'exitCode': exitCode, 'runtime': runtime, 'speculative': job.original is not None}
+
+					# Jobs of a pipeline are taken from the queue only when they can be started soon, so the queue keeps limiting the producer. If nothing runs, we wait for the next job.
+					while source is not None and len(pending) < self.maxParallelJobs:
+						try:
+							cpsFile = source.get(block = not running and not pending, timeout = self.pollInterval)
+						except queue.Empty:
+							break
+						if cpsFile is None:
+							source = None
+						else:
+							pending.append(cpsFile)
+
+					# Speculative copies only use slots that would otherwise be idle
+					if self.speculative is not None and not pending and source is None and len(runtimes) >= self.minSamples:
+						threshold = self._percentile(runtimes, self.speculative)
+						for job in list(running):
+							if len(running) >= self.maxParallelJobs or not self._admit(running):
+								break
+							if job.original is None and job.twin is None and now - job.startTime > threshold:
+								duplicate = self._makeDuplicate(job.cpsFile)
+								job.twin = _Job(duplicate, self._start(duplicate, log), now, original = job)
+								job.twin.twin = job
+								running.append(job.twin)
+
+					while pending and len(running) < self.maxParallelJobs and self._admit(running):
+						cpsFile = pending.popleft()
+						running.append(_Job(cpsFile, self._start(cpsFile, log), time.monotonic()))
+
+					if self.progress is not None:
+						for _ in range(len(results) - finished):
+							self.progress.jobFinished()
+						# The number of waiting jobs of a pipeline is unknown until the last job has arrived
+						self._reportProgress(results, running, len(pending) if source is None else None, cpuStart, force = not pending and not running and source is None)
+
+					if running:
+						time.sleep(self.pollInterval)
+			finally:
+				# After an interruption (e.g. Ctrl-C) or an error, no CopasiSE may keep running in its own process group
+				self._killAll(running)
+
+		return results
+
+
+	def _reportProgress(self, results, running, pending, cpuStart, force = False):
+		"""
+		Hands the current state of the jobs to the ProgressReporter.
+
+		:param results: The results so far
+		:param running: The list of running jobs
+		:param pending: Number of waiting jobs or None if it is not known yet
+		:param cpuStart: os.times() at the start of run()
+		:param force: Write the status regardless of the interval
+		"""
+
+		# Reading the CPU times of all running jobs from /proc is only worth it if the status is written
+		if not self.progress.due(force):
+			return
+
+		completed = sum(result['status'] == 'finished' for result in results.values())
+		times = os.times()
+		cpuSeconds = times.children_user + times.children_system - cpuStart.children_user - cpuStart.children_system
+		cpuSeconds += sum(_processCpuTime(job.proc.pid) for job in running)
+		# A job and its speculative copy count as a single running job
+		runningJobs = len(set(job.original or job for job in running))
+		self.progress.update(completed, len(results) - completed, runningJobs, pending, cpuSeconds, force = force)
+
+
+	def _admit(self, running):
+		"""
+		Decides whether the memory allows to start another job. The expected RSS of a new job is the highest RSS observed so far. Jobs that are still growing towards this value are counted with their expected RSS, so that several jobs started at once do not overcommit memory. If no RSS was observed yet, only a single job is started, unless finished jobs could not be measured at all. If nothing runs, a job is always admitted.
+
+		:param running: The list of running jobs
+		:returns: True if a new job may be started
+		"""
+
+		if not self.memoryAware or not running:
+			return True
+
+		# Until the first job is measured, only one job is started. If memory cannot be measured at all, the number of jobs is not limited.
+		if self.observedRSS == 0:
+			return self.unmeasured
+
+		available = availableMemory()
+		if available is None:
+			return True
+
+		reserved = sum(max(self.observedRSS - job.rss, 0) for job in running)
+		admit = available - reserved >= self.observedRSS * self.memorySafety
+		if not admit and not self.throttled:
+			self.throttled = True
+			self.errorReport('Available memory ({:.0f} MB) limits the number of parallel jobs to {} (about {:.0f} MB per job).'.format(available / 2**20, len(running), self.observedRSS / 2**20))
+
+		return admit
+
+
+	def _poll(self, job):
+		"""
+		Checks whether a job has exited. With memory-aware execution, the job is reaped with os.wait4() to get its peak RSS, as short jobs often exit before their memory was sampled.
+
+		:param job: The _Job to check
+		:returns: The exit code or None if the job is still running
+		"""
+
+		if not self.memoryAware or job.proc.returncode is not None:
+			return job.proc.poll()
+
+		try:
+			pid, status, usage = os.wait4(job.proc.pid, os.WNOHANG)
+		except (ChildProcessError, AttributeError):	# Already reaped or no wait4() on this platform
+			pid = None
+		if pid == 0:
+			return None
+
+		if pid is None:
+			exitCode = job.proc.poll()
+		else:
+			# ru_maxrss is given in kilobytes on Linux
+			job.peakRSS = max(job.peakRSS, usage.ru_maxrss * 1024)
+			self.observedRSS = max(self.observedRSS, job.peakRSS)
+			# Same convention as Popen: negative numbers for signals
+			exitCode = job.proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+		if exitCode is not None and job.peakRSS == 0:
+			self.unmeasured = True
+
+		return exitCode
+
+
+	def exitCode(self, results):
+		"""
+		Summarizes the results of run() in a single exit code.
+
+		:param results: The dictionary returned by run()
+		:returns: 0 if all jobs finished successfully, 1 otherwise
+		"""
+
+		return int(any(result['status'] != 'finished' for result in results.values()))
+
+
+	def _start(self, cpsFile, log):
+		"""
+		Starts CopasiSE for a single file in its own process group.
+
+		:param cpsFile: The Copasi file to execute
+		:param log: Open file object that receives stdout and stderr
+		:returns: The Popen object of the started process
+		"""
+
+		return subprocess.Popen(self.copasiCommand + [cpsFile], stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+	def _kill(self, job, running):
+		"""
+		Kills a running job (including any children CopasiSE might have) and removes it from the list of running jobs.
+
+		:param job: The _Job to kill
+		:param running: The list of running jobs
+		"""
+
+		try:
+			os.killpg(job.proc.pid, signal.SIGKILL)
+		except ProcessLookupError:
+			pass
+		job.proc.wait()
+		if job in running:
+			running.remove(job)
+
+
+	def _killAll(self, running):
+		"""
+		Kills all running jobs and removes the files of speculative copies.
+
+		:param running: The list of running jobs
+		"""
+
+		for job in list(running):
+			self._kill(job, running)
+			if job.original is not None:
+				try:
+					self._cleanDuplicate(job.cpsFile)
+				except OSError as e:
+					self.errorReport('The speculative copy {} could not be removed.\n{}'.format(job.cpsFile, e))
+
+
+	def _percentile(self, values, percentile):
+		"""
+		Nearest-rank percentile of a list of numbers.
+
+		:param values: A non-empty list of numbers
+		:param percentile: The percentile (0-100)
+		:returns: The value at the given percentile
+		"""
+
+		ordered = sorted(values)
+		rank = int(round(percentile / 100 * (len(ordered) - 1)))
+		return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+	def _makeDuplicate(self, cpsFile):
+		"""
+		Writes a speculative copy of a Copasi file with a new seed and its own report file names.
+
+		:param cpsFile: The Copasi file to copy
+		:returns: The file name of the copy
+		"""
+
+		with open(cpsFile, 'r', encoding='utf-8') as f:
+			content = f.read()
+
+		# A seed of 0 lets Copasi choose a seed itself, so any other value gives a different random stream
+		content = re.sub(r'(<Parameter name="Seed" type="unsignedInteger" value=")\d+("/>)', lambda m: m.group(1) + str(random.randint(1, 2**31 - 1)) + m.group(2), content)
+		content = re.sub('target="([^"]+)"', lambda m: 'target="' + self._duplicateName(m.group(1)) + '"', content)
+
+		duplicate = self._duplicateName(cpsFile)
+		with open(duplicate, 'w', encoding='utf-8') as f:
+			f.write(content)
+
+		return duplicate
+
+
+	def _duplicateName(self, filename):
+		"""
+		:param filename: A file name of an original job
+		:returns: The corresponding file name of the speculative copy
+		"""
+
+		base, ext = os.path.splitext(filename)
+		return base + '_spec' + ext
+
+
+	def _promoteDuplicate(self, duplicate, cpsFile):
+		"""
+		Moves the reports of a winning speculative copy to the report files of the original job and removes the copy.
+
+		:param duplicate: The Copasi file of the speculative copy
+		:param cpsFile: The Copasi file of the original job
+		"""
+
+		for dupReport, report in zip(reportTargets(duplicate), reportTargets(cpsFile)):
+			if os.path.exists(dupReport):
+				os.replace(dupReport, report)
+		os.remove(duplicate)
+
+
+	def _cleanDuplicate(self, duplicate):
+		"""
+		Removes a speculative copy and any (partial) reports it has written.
+
+		:param duplicate: The Copasi file of the speculative copy
+		"""
+
+		for report in reportTargets(duplicate):
+			if os.path.exists(report):
+				os.remove(report)
+		os.remove(duplicate)
+
+
+class ChunkedCopasiExecutor(CopasiExecutor):
+	"""
+	Runs CopasiSE on a list of Copasi files with a fixed number of worker slots. Each slot takes a chunk of files, stages them in a local scratch directory (e.g. the tmpfs /dev/shm), runs them back to back and copies the reports back in one batch. For jobs of about a second, this avoids most of the overhead of reading and writing many small files on a shared file system. The chunk size can be tuned automatically from the observed runtimes.
+	"""
+
+	def __init__(self, copasiPath, maxParallelJobs = 0, chunkSize = 'auto', scratchDir = None, chunkTime = 10, maxChunkSize = 256, timeout = None, progress = None, deleteInputs = False, logFile = 'copasiOut.txt', errorReport = None):
+		"""
+		:param copasiPath: Path to CopasiSE or it's name in the PATH variable
+		:param maxParallelJobs: Number of worker slots. 0 means one slot per usable CPU (see effectiveCpuCount())
+		:param chunkSize: Number of files per chunk or 'auto' to aim at chunks of chunkTime seconds
+		:param scratchDir: Directory to stage the files in. Defaults to defaultScratchDir()
+		:param chunkTime: With chunkSize 'auto': seconds a chunk should take
+		:param maxChunkSize: With chunkSize 'auto': maximum number of files per chunk
+		:param timeout: Wall-clock limit in seconds for each job or None for no limit. Jobs exceeding the limit are killed and recorded as timed out
+		:param progress: A ProgressReporter that receives the progress of the jobs or None
+		:param deleteInputs: If True, the Copasi file of a successfully finished job is deleted (the report is kept)
+		:param logFile: File to which stdout and stderr of CopasiSE are appended
+		:param errorReport: Function to report errors with (e.g. Copasi._errorReport). Defaults to printing to stderr
+		"""
+
+		super().__init__(copasiPath, maxParallelJobs, timeout = timeout, progress = progress, deleteInputs = deleteInputs, logFile = logFile, errorReport = errorReport)
+		self.chunkSize = chunkSize
+		self.scratchDir = os.path.abspath(scratchDir or defaultScratchDir())
+		# CopasiSE runs in the scratch directory of a slot, so a relative path to CopasiSE has to be made absolute
+		if os.sep in self.copasiCommand[0]:
+			self.copasiCommand[0] = os.path.abspath(self.copasiCommand[0])
+		self.chunkTime = chunkTime
+		self.maxChunkSize = maxChunkSize
+
+
+	def run(self, fileList):
+		"""
+		Executes CopasiSE for every file in fileList and waits until all jobs are finished, timed out or failed.
+
+		:param fileList: The list of Copasi files as strings that shall be executed or a queue.Queue that delivers Copasi files as soon as they are ready and None after the last one (see Copasi.pipelineCopasi())
+		:returns: A dictionary like CopasiExecutor.run(). There is no speculative execution, so 'speculative' is always False
+		"""
+
+		if isinstance(fileList, queue.Queue):
+			self._source = fileList
+			self._pending = deque()
+		else:
+			self._source = None
+			self._pending = deque(fileList)
+		self._takeLock = threading.Lock()		# Only one slot takes a chunk at a time
+		self._lock = threading.Lock()			# Protects the results and counters below
+		self._results = {}
+		self._runtimes = deque(maxlen = 100)	# Runtimes of recent successful jobs for the chunk size
+		self._taken = 0							# Files in chunks that are not finished yet
+		self._running = 0						# Running CopasiSE processes
+		self._cpuStart = os.times()
+		self._stop = threading.Event()			# Tells the slots to kill their job and to stop, e.g. after Ctrl-C
+
+		try:
+			runDir = tempfile.mkdtemp(prefix = 'copasi_chunks_', dir = self.scratchDir)
+		except OSError as e:
+			self.errorReport('Could not create a scratch directory in {}. Using {} instead.\n{}'.format(self.scratchDir, tempfile.gettempdir(), e))
+			runDir = os.path.abspath(tempfile.mkdtemp(prefix = 'copasi_chunks_'))
+
+		try:
+			with open(self.logFile, 'a') as log:
+				slots = [threading.Thread(target = self._slot, args = (os.path.join(runDir, 'slot{}'.format(n)), log)) for n in range(self.maxParallelJobs)]
+				try:
+					for slot in slots:
+						slot.start()
+					# Joining with a timeout lets Ctrl-C reach the main thread while the slots run
+					for slot in slots:
+						while slot.is_alive():
+							slot.join(self.pollInterval)
+				finally:
+					# After an interruption or an error, the slots kill their CopasiSE and stop. The scratch directory is only removed afterwards.
+					self._stop.set()
+					for slot in slots:
+						if slot.ident is not None:
+							slot.join()
+		finally:
+			shutil.rmtree(runDir, ignore_errors = True)
+
+		if self.progress is not None:
+			self._reportChunkProgress(force = True)
+
+		return self._results
+
+
+	def _slot(self, slotDir, log):
+		"""
+		A worker slot. Takes chunks and runs them in its own scratch directory until no files are left.
+
+		:param slotDir: The scratch directory of the slot
+		:param log: Open file object that receives stdout and stderr
+		"""
+
+		try:
+			os.makedirs(slotDir)
+		except OSError as e:
+			# Staging fails then as well, so every file of the slot is recorded as failed
+			self.errorReport('Could not create the scratch directory {}.\n{}'.format(slotDir, e))
+		while not self._stop.is_set():
+			chunk = self._takeChunk()
+			if not chunk:
+				break
+			try:
+				self._runChunk(chunk, slotDir, log)
+			except Exception as e:
+				# The slot keeps running, so the remaining files are not left unprocessed
+				self.errorReport('A chunk of {} files failed in {}.\n{}'.format(len(chunk), slotDir, e))
+				self._recordOutcomes(chunk, {cpsFile: ('failed', None, 0.0) for cpsFile in chunk})
+
+
+	def _takeChunk(self):
+		"""
+		Takes the next chunk of Copasi files. Of a pipeline, only the first file of a chunk is waited for, the others are taken as far as they are already available.
+
+		:returns: A list of Copasi files, empty if no files are left
+		"""
+
+		with self._takeLock:
+			size = self._nextChunkSize()
+			chunk = []
+			while self._pending and len(chunk) < size:
+				chunk.append(self._pending.popleft())
+			while self._source is not None and len(chunk) < size:
+				try:
+					cpsFile = self._source.get(block = not chunk, timeout = self.pollInterval)
+				except queue.Empty:
+					if chunk or self._stop.is_set():
+						break
+					continue
+				if cpsFile is None:
+					self._source = None
+				else:
+					chunk.append(cpsFile)
+
+			with self._lock:
+				self._taken += len(chunk)
+
+		return chunk
+
+
+	def _nextChunkSize(self):
+		"""
+		Determines the size of the next chunk. With 'auto', a chunk should take about chunkTime seconds, based on the median runtime of recent jobs. Until the first jobs are finished, chunks of a single file measure the runtime. If the number of remaining files is known, chunks are kept small enough to give every slot some work.
+
+		:returns: The number of files of the next chunk
+		"""
+
+		if self.chunkSize != 'auto':
+			return self.chunkSize
+
+		with self._lock:
+			runtimes = list(self._runtimes)
+		if not runtimes:
+			return 1
+
+		size = int(self.chunkTime / max(self._percentile(runtimes, 50), 0.001))
+		if self._source is None:
+			size = min(size, math.ceil(len(self._pending) / self.maxParallelJobs))
+
+		return min(max(size, 1), self.maxChunkSize)
+
+
+	def _runChunk(self, chunk, slotDir, log):
+		"""
+		Stages a chunk of Copasi files in the scratch directory of a slot, runs them back to back and copies all reports back afterwards.
+
+		:param chunk: A list of Copasi files
+		:param slotDir: The scratch directory of the slot
+		:param log: Open file object that receives stdout and stderr
+		"""
+
+		outcomes = {}	# {cpsFile: (status, exitCode, runtime)}
+		staged = []		# Tuples (cpsFile, staged file, [(staged report, report), ...])
+		for i, cpsFile in enumerate(chunk):
+			try:
+				with open(cpsFile, 'r', encoding='utf-8') as f:
+					content = f.read()
+
+				# Reports are written to the scratch directory. Existing reports are staged as well, as Copasi may append to them.
+				reports = [(os.path.join(slotDir, '{}_{}_{}'.format(i, k, os.path.basename(report))), report) for k, report in enumerate(reportTargets(cpsFile, content))]
+				localNames = iter(os.path.basename(local) for local, _ in reports)
+				content = re.sub('target="([^"]+)"', lambda m: 'target="' + next(localNames) + '"', content)
+				for local, report in reports:
+					if os.path.exists(report):
+						shutil.copyfile(report, local)
+
+				stagedFile = os.path.join(slotDir, '{}.cps'.format(i))
+				with open(stagedFile, 'w', encoding='utf-8') as f:
+					f.write(content)
+			except OSError as e:
+				self.errorReport('{} could not be staged in {}.\n{}'.format(cpsFile, slotDir, e))
+				outcomes[cpsFile] = ('failed', None, 0.0)
+				continue
+			staged.append((cpsFile, stagedFile, reports))
+
+		for cpsFile, stagedFile, reports in staged:
+			with self._lock:
+				self._running += 1
+			try:
+				outcomes[cpsFile] = self._runJob(cpsFile, stagedFile, slotDir, log)
+			finally:
+				with self._lock:
+					self._running -= 1
+			if self._stop.is_set():
+				# The results are not used anymore, so the reports are not copied back
+				return
+
+		# All reports of the chunk are copied back at once
+		for cpsFile, stagedFile, reports in staged:
+			for local, report in reports:
+				if not os.path.exists(local):
+					continue
+				try:
+					shutil.copyfile(local, report)
+				except OSError as e:
+					self.errorReport('The report {} could not be copied back from {}.\n{}'.format(report, local, e))
+					outcomes[cpsFile] = ('failed',) + outcomes[cpsFile][1:]
+				self._removeFile(local)
+			self._removeFile(stagedFile)
+
+		self._recordOutcomes(chunk, outcomes)
+
+
+	def _runJob(self, cpsFile, stagedFile, slotDir, log):
+		"""
+		Runs CopasiSE on a single staged file and updates the progress while it runs.
+
+		:param cpsFile: The original Copasi file
+		:param stagedFile: The staged copy of the Copasi file
+		:param slotDir: The scratch directory of the slot
+		:param log: Open file object that receives stdout and stderr
+		:returns: A tuple (status, exitCode, runtime)
+		"""
+
+		startTime = time.monotonic()
+		try:
+			proc = subprocess.Popen(self.copasiCommand + [stagedFile], stdout=log, stderr=subprocess.STDOUT, start_new_session=True, cwd=slotDir)
+		except OSError as e:
+			self.errorReport('CopasiSE could not be started for {}.\n{}'.format(cpsFile, e))
+			return ('failed', None, 0.0)
+
+		while True:
+			try:
+				exitCode = proc.wait(timeout = self.pollInterval)
+				return ('finished' if exitCode == 0 else 'failed', exitCode, time.monotonic() - startTime)
+			except subprocess.TimeoutExpired:
+				pass
+
+			if self._stop.is_set() or self.timeout is not None and time.monotonic() - startTime > self.timeout:
+				try:
+					os.killpg(proc.pid, signal.SIGKILL)
+				except ProcessLookupError:
+					pass
+				proc.wait()
+				if self._stop.is_set():
+					return ('failed', None, time.monotonic() - startTime)
+				self.errorReport('{} exceeded the time limit of {} s and was killed.'.format(cpsFile, self.timeout))
+				return ('timeout', None, time.monotonic() - startTime)
+
+			# Chunks may run for a long time, so the progress is updated while a job runs as well
+			if self.progress is not None:
+				with self._lock:
+					self._reportChunkProgress()
+
+
+	def _recordOutcomes(self, chunk, outcomes):
+		"""
+		Stores the results of a chunk. Files that already have a result are skipped.
+
+		:param chunk: A list of Copasi files
+		:param outcomes: A dictionary {cpsFile: (status, exitCode, runtime)}
+		"""
+
+		with self._lock:
+			for cpsFile in chunk:
+				if cpsFile in self._results:
+					continue
+				status, exitCode, runtime = outcomes[cpsFile]
+				self._results[cpsFile] = {'status': status, 'exitCode': exitCode, 'runtime': runtime, 'speculative': False}
+				self._taken -= 1
+				if status == 'finished':
+					self._runtimes.append(runtime)
+					if self.deleteInputs:
+						self._removeFile(cpsFile)
+				if self.progress is not None:
+					self.progress.jobFinished()
+
+			if self.progress is not None:
+				self._reportChunkProgress()
+
+
+	def _removeFile(self, filename):
+		"""
+		Removes a file and reports if that fails.
+
+		:param filename: The file to remove
+		"""
+
+		try:
+			os.remove(filename)
+		except OSError as e:
+			self.errorReport('{} could not be removed.\n{}'.format(filename, e))
+
+
+	def _reportChunkProgress(self, force = False):
+		"""
+		Hands the current state of the jobs to the ProgressReporter. Staged files that wait for their turn count as pending.
+
+		:param force: Write the status regardless of the interval
+		"""
+
+		if not self.progress.due(force):
+			return
+
+		completed = sum(result['status'] == 'finished' for result in self._results.values())
+		times = os.times()
+		cpuSeconds = times.children_user + times.children_system - self._cpuStart.children_user - self._cpuStart.children_system
+		# The number of waiting jobs of a pipeline is unknown until the last job has arrived
+		pending = len(self._pending) + self._taken - self._running if self._source is None else None
+		self.progress.update(completed, len(self._results) - completed, self._running, pending, cpuSeconds, force = force)
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+
+helptext = '''Runs Copasi files on several computers. A coordinator serves a queue of
+Copasi files over TCP. Workers on any host connect to the coordinator,
+fetch a Copasi file, run CopasiSE locally and send the reports back. The
+coordinator writes the reports to the place where CopasiSE would have
+written them and requeues jobs of workers that are lost (closed
+connection or missing heartbeats). Every worker slot uses its own
+connection.
+
+The coordinator listens on localhost unless another address is given.
+There is no encryption, so only listen on other interfaces within a
+trusted network and give a shared token to the coordinator and the
+workers (--token or the environment variable COPASI_TOKEN). Workers
+with another token are refused.
+
+Start the coordinator e.g. like this:
+COPASI_TOKEN=secret ./distributedCopasi.py coordinator -a 0.0.0.0:8642 myFiles_*.cps
+
+and the workers (on every host) e.g. like this:
+COPASI_TOKEN=secret ./distributedCopasi.py worker coordinatorhost:8642 -p 8
+
+The protocol consists of JSON objects, one per line:
+worker -> coordinator: {"type": "request", "worker": NAME, "token": TOKEN}
+coordinator -> worker: {"type": "job", "id": ID, "name": FILENAME, "cps": CONTENT}, {"type": "wait", "seconds": S} or {"type": "done"}
+worker -> coordinator: {"type": "heartbeat", "id": ID} (while CopasiSE runs)
+worker -> coordinator: {"type": "result", "id": ID, "exitCode": CODE, "status": STATUS, "reports": [CONTENT or null, ...], "log": OUTPUT}
+coordinator -> worker: {"type": "ack"}'''
+
+
+import sys						# For exiting and stderr printing
+import os						# To handle files
+import re						# Regular expressions
+import json						# The wire format
+import socket					# To connect workers to the coordinator
+import socketserver				# To serve the queue to several workers at once
+import hmac						# To compare tokens in constant time
+import threading				# To protect the queue
+import subprocess				# To start CopasiSE
+import tempfile					# Workers run every job in a scratch directory
+import shlex					# To split the CopasiSE command safely
+import time						# For heartbeats and timeouts
+from collections import deque	# Queue of waiting jobs
+from datetime import datetime	# To get a feeling of time
+from shutil import which		# To check whether a given Copasi program name is valid
+from copasiExecutor import reportTargets	# To find the report files of a Copasi file
+
+
+def _errorReport(text, fatal = False):
+	"""
+	Reports errors and aborts if the error is fatal.
+
+	:param text: String to be printed
+	:param fatal: Boolean to state whether the error is fatal
+	"""
+
+	textend = ('Continuing.', 'Aborting.')
+
+	print('{} distributedCopasi: {} - {}'.format(datetime.now().strftime('%c'), text, textend[fatal]), file=sys.stderr)
+	if fatal:
+		sys.exit(1)
+
+
+def parseAddress(address, defaultHost = ''):
+	"""
+	Splits an address of the form host:port or just port.
+
+	:param address: The address as a string
+	:param defaultHost: The host to use if only a port is given
+	:returns: A tuple (host, port)
+	"""
+
+	host, _, port = address.rpartition(':')
+	return (host or defaultHost, int(port))
+
+
+def _send(wfile, message):
+	"""
+	Sends a single message.
+
+	:param wfile: A writable binary file object of the socket
+	:param message: A dictionary that can be serialized to JSON
+	"""
+
+	wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+	wfile.flush()
+
+
+def _receive(rfile):
+	"""
+	Receives a single message.
+
+	:param rfile: A readable binary file object of the socket
+	:returns: The received dictionary
+	:raises ConnectionError: If the connection was closed
+	"""
+
+	line = rfile.readline()
+	if not line:
+		raise ConnectionError('Connection closed')
+
+	return json.loads(line.decode('utf-8'))
+
+
+class _CoordinatorHandler(socketserver.StreamRequestHandler):
+	"""
+	Serves a single worker connection. All state is kept in the Coordinator.
+	"""
+
+	def handle(self):
+		coordinator = self.server.coordinator
+		connection = object()	# Identifies the jobs held by this connection
+		try:
+			# The first message of a connection has to carry the token of the coordinator
+			message = _receive(self.rfile)
+			if not coordinator._authorized(message):
+				coordinator.errorReport('Refused worker {}:{} with a wrong token.'.format(*self.client_address))
+				return
+			while True:
+				if message['type'] == 'request':
+					_send(self.wfile, coordinator._assign(connection, message.get('worker', '{}:{}'.format(*self.client_address))))
+				elif message['type'] == 'heartbeat':
+					coordinator._heartbeat(message['id'])
+				elif message['type'] == 'result':
+					coordinator._finish(message)
+					_send(self.wfile, {'type': 'ack'})
+				message = _receive(self.rfile)
+		except (OSError, ValueError, KeyError, TypeError):
+			pass
+		finally:
+			coordinator._release(connection)
+
+
+class _CoordinatorServer(socketserver.ThreadingTCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+
+
+class Coordinator:
+	"""
+	Serves a list of Copasi files to workers and collects their reports.
+	"""
+
+	def __init__(self, fileList, address = ('localhost', 8642), heartbeatTimeout = 30, progress = None, logFile = 'copasiOut.txt', errorReport = _errorReport, token = None):
+		"""
+		:param fileList: The list of Copasi files as strings that shall be executed
+		:param address: Tuple (host, port) to listen on. Port 0 picks a free port (see self.address). Use ('', port) to listen on all interfaces
+		:param heartbeatTimeout: Seconds without heartbeat after which a job is requeued
+		:param progress: A ProgressReporter that receives the progress of the jobs or None. CPU usage of the workers is not reported
+		:param logFile: File to which the output of CopasiSE (sent by the workers) is appended
+		:param errorReport: Function to report errors with (e.g. Copasi._errorReport)
+		:param token: A shared secret workers have to send or None to accept every worker
+		"""
+
+		self.fileList = list(fileList)
+		self.token = token
+		self.heartbeatTimeout = heartbeatTimeout
+		self.progress = progress
+		self.logFile = logFile
+		self.errorReport = errorReport
+
+		self.lock = threading.Lock()
+		self.pending = deque(enumerate(self.fileList))	# (id, cpsFile)
+		self.assigned = {}		# id -> {'cpsFile', 'worker', 'connection', 'heartbeat', 'startTime'}
+		self.results = {}		# cpsFile -> result dictionary
+		self.handedOut = set()	# ids of all jobs that were sent to a worker
+
+		self.server = _CoordinatorServer(address, _CoordinatorHandler)
+		self.server.coordinator = self
+		self.address = self.server.server_address
+
+
+	def run(self):
+		"""
+		Serves the jobs until every job has a result.
+
+		:returns: A dictionary in the form {cpsFile: {'status': 'finished'|'failed'|'timeout', 'exitCode': int or None, 'runtime': seconds, 'speculative': False, 'worker': name}}
+		"""
+
+		thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		thread.start()
+
+		try:
+			while True:
+				time.sleep(min(1, self.heartbeatTimeout / 2))
+				with self.lock:
+					now = time.monotonic()
+					for jobId, job in list(self.assigned.items()):
+						if now - job['heartbeat'] > self.heartbeatTimeout:
+							self.errorReport('Worker {} did not send a heartbeat for {}. Requeuing it.'.format(job['worker'], job['cpsFile']))
+							self._requeue(jobId)
+					done = not self.pending and not self.assigned
+					if self.progress is not None:
+						completed = sum(result['status'] == 'finished' for result in self.results.values())
+						self.progress.update(completed, len(self.results) - completed, len(self.assigned), len(self.pending), force = done)
+					if done:
+						break
+		finally:
+			self.server.shutdown()
+			self.server.server_close()
+
+		return self.results
+
+
+	def _assign(self, connection, worker):
+		"""
+		Hands out the next job.
+
+		:param connection: The identifier of the worker connection
+		:param worker: The name of the worker
+		:returns: The message to send to the worker
+		"""
+
+		while True:
+			with self.lock:
+				if not self.pending:
+					# Jobs of lost workers might be requeued, so workers wait until everything is finished
+					if self.assigned:
+						return {'type': 'wait', 'seconds': 1}
+					return {'type': 'done'}
+
+				jobId, cpsFile = self.pending.popleft()
+				now = time.monotonic()
+				self.assigned[jobId] = {'cpsFile': cpsFile, 'worker': worker, 'connection': connection, 'heartbeat': now, 'startTime': now}
+
+			try:
+				with open(cpsFile, 'r', encoding='utf-8') as f:
+					content = f.read()
+			except OSError as e:
+				# Requeuing would fail again, so the job is failed and the next one is handed out
+				self.errorReport('{} could not be read.\n{}'.format(cpsFile, e))
+				with self.lock:
+					del self.assigned[jobId]
+					self.results[cpsFile] = {'status': 'failed', 'exitCode': None, 'runtime': 0.0, 'speculative': False, 'worker': None}
+					if self.progress is not None:
+						self.progress.jobFinished()
+				continue
+
+			with self.lock:
+				self.handedOut.add(jobId)
+			return {'type': 'job', 'id': jobId, 'name': os.path.basename(cpsFile), 'cps': content}
+
+
+	def _authorized(self, message):
+		"""
+		Checks the token of a worker.
+
+		:param message: The first message of the worker
+		:returns: True if the coordinator has no token or the message carries the same token
+		"""
+
+		if self.token is None:
+			return True
+
+		return hmac.compare_digest(str(message.get('token', '')).encode('utf-8'), self.token.encode('utf-8'))
+
+
+	def _heartbeat(self, jobId):
+		"""
+		Notes that a worker is still working on a job.
+
+		:param jobId: The id of the job
+		"""
+
+		with self.lock:
+			if jobId in self.assigned:
+				self.assigned[jobId]['heartbeat'] = time.monotonic()
+
+
+	def _finish(self, message):
+		"""
+		Stores the result of a job and writes its reports. If a job was requeued and finished twice, the first result is kept.
+
+		:param message: The result message of the worker
+		"""
+
+		jobId = message['id']
+		with self.lock:
+			# Only jobs that were handed out (and possibly requeued since) are accepted
+			if type(jobId) is not int or jobId not in self.handedOut:
+				self.errorReport('Ignoring a result for the unknown job id {!r}.'.format(jobId))
+				return
+			cpsFile = self.fileList[jobId]
+			if cpsFile in self.results:
+				return
+			job = self.assigned.pop(jobId, None)
+			# A job that was requeued after a lost heartbeat is taken out of the queue again
+			for n, (pendingId, _) in enumerate(self.pending):
+				if pendingId == jobId:
+					del self.pending[n]
+					break
+			if self.progress is not None:
+				self.progress.jobFinished()
+			self.results[cpsFile] = {'status': message['status'], 'exitCode': message['exitCode'], 'runtime': time.monotonic() - job['startTime'] if job is not None else None, 'speculative': False, 'worker': job['worker'] if job is not None else None}
+
+		for report, content in zip(reportTargets(cpsFile), message['reports']):
+			if content is not None:
+				with open(report, 'w', encoding='utf-8') as f:
+					f.write(content)
+
+		with open(self.logFile, 'a') as log:
+			log.write(message['log'])
+
+
+	def _release(self, connection):
+		"""
+		Requeues all jobs of a closed worker connection.
+
+		:param connection: The identifier of the worker connection
+		"""
+
+		with self.lock:
+			for jobId, job in list(self.assigned.items()):
+				if job['connection'] is connection:
+					self.errorReport('Lost connection to worker {} while running {}. Requeuing it.'.format(job['worker'], job['cpsFile']))
+					self._requeue(jobId)
+
+
+	def _requeue(self, jobId):
+		"""
+		Puts an assigned job back to the front of the queue. The lock must be held.
+
+		:param jobId: The id of the job
+		"""
+
+		del self.assigned[jobId]
+		self.pending.appendleft((jobId, self.fileList[jobId]))
+
+
+class Worker:
+	"""
+	Fetches Copasi files from a coordinator, runs them with CopasiSE and sends the reports back.
+	"""
+
+	def __init__(self, address, copasiPath = 'copasise', name = None, timeout = None, heartbeat = 5, connectTimeout = 60, scratchDir = None, token = None):
+		"""
+		:param address: Tuple (host, port) of the coordinator
+		:param copasiPath: Path to CopasiSE or it's name in the PATH variable
+		:param name: The name of the worker, used in messages of the coordinator. Defaults to hostname:pid
+		:param timeout: Wall-clock limit in seconds for each job or None for no limit
+		:param heartbeat: Seconds between two heartbeats while CopasiSE runs
+		:param connectTimeout: Seconds to keep trying to reach the coordinator
+		:param scratchDir: Directory for the temporary job directories. Defaults to the system default
+		:param token: The shared secret of the coordinator or None
+		"""
+
+		self.address = address
+		self.copasiCommand = shlex.split(copasiPath)
+		# CopasiSE runs in the scratch directory, so a relative path has to be made absolute
+		program = which(self.copasiCommand[0])
+		if program is not None:
+			self.copasiCommand[0] = os.path.abspath(program)
+		self.token = token
+		self.name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+		self.timeout = timeout
+		self.heartbeat = heartbeat
+		self.connectTimeout = connectTimeout
+		self.scratchDir = scratchDir
+
+
+	def run(self):
+		"""
+		Works on jobs until the coordinator has no more jobs or is gone.
+
+		:returns: The number of jobs this worker has run
+		"""
+
+		sock = self._connect()
+		done = 0
+		with sock, sock.makefile('rb') as rfile, sock.makefile('wb') as wfile:
+			try:
+				while True:
+					_send(wfile, {'type': 'request', 'worker': self.name, 'token': self.token})
+					message = _receive(rfile)
+					if message['type'] == 'done':
+						break
+					elif message['type'] == 'wait':
+						time.sleep(message['seconds'])
+						continue
+
+					_send(wfile, self._runJob(message, wfile))
+					_receive(rfile)		# ack
+					done += 1
+			except (OSError, ValueError):
+				# The coordinator shuts down as soon as all results are in (or refuses the token)
+				pass
+
+		return done
+
+
+	def _connect(self):
+		"""
+		Connects to the coordinator. Retries until connectTimeout is reached, so workers can be started before the coordinator.
+
+		:returns: The connected socket
+		"""
+
+		deadline = time.monotonic() + self.connectTimeout
+		while True:
+			try:
+				return socket.create_connection(self.address)
+			except OSError as e:
+				if time.monotonic() > deadline:
+					_errorReport('Could not connect to the coordinator at {}:{}.\n{}'.format(self.address[0], self.address[1], e), fatal = True)
+				time.sleep(1)
+
+
+	def _runJob(self, message, wfile):
+		"""
+		Runs a single job in a scratch directory and sends heartbeats while CopasiSE runs.
+
+		:param message: The job message of the coordinator
+		:param wfile: A writable binary file object of the socket for the heartbeats
+		:returns: The result message
+		"""
+
+		try:
+			return self._runJobInScratch(message, wfile)
+		except OSError as e:
+			# E.g. CopasiSE could not be started or the scratch directory is full. The job is reported as failed, so the coordinator does not wait for it.
+			_errorReport('Could not run {}.\n{}'.format(message['name'], e))
+			return {'type': 'result', 'id': message['id'], 'exitCode': None, 'status': 'failed', 'reports': [], 'log': '{}: {}\n'.format(message['name'], e)}
+
+
+	def _runJobInScratch(self, message, wfile):
+		"""
+		Stages a job into a scratch directory, runs CopasiSE there and collects the reports.
+
+		:param message: The job message of the coordinator
+		:param wfile: A writable binary file object of the socket for the heartbeats
+		:returns: The result message
+		:raises OSError: If the job could not be staged or CopasiSE could not be started
+		"""
+
+		with tempfile.TemporaryDirectory(prefix='copasi_', dir=self.scratchDir) as scratch:
+			# All reports are written to the scratch directory. Their order is the same as on the coordinator's side.
+			targets = []
+			def _localTarget(match):
+				targets.append(os.path.join(scratch, 'report_{}.txt'.format(len(targets))))
+				return 'target="{}"'.format(targets[-1])
+			content = re.sub('target="([^"]+)"', _localTarget, message['cps'])
+
+			cpsFile = os.path.join(scratch, message['name'])
+			with open(cpsFile, 'w', encoding='utf-8') as f:
+				f.write(content)
+
+			status = 'finished'
+			startTime = time.monotonic()
+			with open(os.path.join(scratch, 'copasiOut.txt'), 'w+') as log:
+				proc = subprocess.Popen(self.copasiCommand + [cpsFile], stdout=log, stderr=subprocess.STDOUT, cwd=scratch)
+				while True:
+					try:
+						exitCode = proc.wait(timeout=self.heartbeat)
+						break
+					except subprocess.TimeoutExpired:
+						if self.timeout is not None and time.monotonic() - startTime > self.timeout:
+							proc.kill()
+							exitCode = proc.wait()
+							status = 'timeout'
+							break
+						_send(wfile, {'type': 'heartbeat', 'id': message['id']})
+
+				log.seek(0)
+				output = log.read()
+
+			if status == 'finished' and exitCode != 0:
+				status = 'failed'
+
+			reports = []
+			for target in targets:
+				try:
+					with open(target, 'r', encoding='utf-8', errors='replace') as f:
+						reports.append(f.read())
+				except OSError:
+					reports.append(None)
+
+		return {'type': 'result', 'id': message['id'], 'exitCode': exitCode if status != 'timeout' else None, 'status': status, 'reports': reports, 'log': output}
+
+
+if __name__ == '__main__':
+	import argparse				# To parse arguments
+
+	# Create a new argument parser object
+	parser = argparse.ArgumentParser(description=helptext, formatter_class=argparse.RawDescriptionHelpFormatter)
+	subparsers = parser.add_subparsers(dest='mode')
+	subparsers.required = True
+
+	coordinatorParser = subparsers.add_parser('coordinator', help='Serve Copasi files to workers.')
+	# We need at least one Copasi file
+	coordinatorParser.add_argument('files', nargs='+', metavar='myfile.cps', help='Copasi files that shall be run.')
+	# Optionally, we take the address to listen on
+	coordinatorParser.add_argument('-a', '--address', default='localhost:8642', metavar='host:port', help='Address to listen on. Defaults to localhost:8642. Use e.g. 0.0.0.0:8642 to listen on all interfaces.')
+	# Optionally, we take a shared token workers have to send
+	coordinatorParser.add_argument('--token', default=os.environ.get('COPASI_TOKEN'), metavar='secret', help='Refuse workers without this token. Defaults to the environment variable COPASI_TOKEN.')
+	# Optionally, we take the time after which silent workers are considered lost
+	coordinatorParser.add_argument('--heartbeat-timeout', type=float, default=30, metavar='seconds', help='Requeue jobs of workers that did not send a heartbeat for this long.')
+
+	workerParser = subparsers.add_parser('worker', help='Run Copasi files of a coordinator.')
+	# We need the address of the coordinator
+	workerParser.add_argument('address', metavar='host:port', help='Address of the coordinator.')
+	# Optionally, we take the shared token of the coordinator
+	workerParser.add_argument('--token', default=os.environ.get('COPASI_TOKEN'), metavar='secret', help='Token of the coordinator. Defaults to the environment variable COPASI_TOKEN.')
+	# Optionally, we take the path to CopasiSE
+	workerParser.add_argument('-c', '--copasi', default='copasise', metavar='copasise', help='Path to CopasiSE or shell command to start CopasiSE.')
+	# Optionally, we take the number of slots on this host
+	workerParser.add_argument('-p', '--parallel', type=int, default=1, metavar='#', help='Number of jobs to run on this host at the same time.')
+	# Optionally, we take a wall-clock limit for every single job
+	workerParser.add_argument('-t', '--timeout', type=float, default=None, metavar='seconds', help='Kill and report every job that runs longer than this.')
+	# Optionally, we take a scratch directory
+	workerParser.add_argument('--scratch', default=None, metavar='dir', help='Directory for temporary files of running jobs.')
+	args = parser.parse_args()
+
+	if args.mode == 'coordinator':
+		coordinator = Coordinator(args.files, parseAddress(args.address, 'localhost'), heartbeatTimeout = args.heartbeat_timeout, token = args.token)
+		results = coordinator.run()
+		unfinished = [cpsFile for cpsFile, result in results.items() if result['status'] != 'finished']
+		for cpsFile in unfinished:
+			_errorReport('{} did not finish successfully ({}).'.format(cpsFile, results[cpsFile]['status']))
+		sys.exit(int(bool(unfinished)))
+	else:
+		if which(shlex.split(args.copasi)[0]) is None:
+			_errorReport('CopasiSE not found ({}).'.format(args.copasi), fatal = True)
+		address = parseAddress(args.address, 'localhost')
+		threads = [threading.Thread(target=Worker(address, args.copasi, name = '{}:{}/{}'.format(socket.gethostname(), os.getpid(), n), timeout = args.timeout, scratchDir = args.scratch, token = args.token).run) for n in range(args.parallel)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
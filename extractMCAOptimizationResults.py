@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 
-helptext = '''Extracts results from an MCA optimization. Expects a list of files with MCA optimization results. The names of the result files must be in this format: `someName_row_column.txt`. This format is automatically generated when `updateMCAOptimizationTarget.py` was used to generate the output files.
+helptext = '''Extracts results from an MCA optimization. Expects a list of files with MCA optimization results. The names of the result files must be in this format: `someName_row_column.txt`. This format is automatically generated when `updateMCAOptimizationTarget.py` was used to generate the output files. Files in hashed subdirectories (`updateMCAOptimizationTarget.py --shard`) are summarized as if they were not sharded.
 
 Start the script e.g. like this:
 ./extractMCAOptimizationResults.py myResult_abc_def.txt myResult_abc_ghi.txt'''
 
 import sys
+import os.path
+from copasi import shardDirectory	# To recognise hashed subdirectories
 
 if len(sys.argv) < 2:
 	print(helptext)
@@ -16,6 +18,11 @@ results = {}
 for filename in sys.argv[1:]:
 	with open(filename, 'r') as f:
 		basefile = filename.replace('.txt', '')
+		# Remove hashed subdirectories (see shardDirectory() in copasi.py), so all shards end up in the same summary. An MD5 hash has 16 levels at most.
+		directory, name = os.path.split(basefile)
+		parts = directory.split(os.sep) if directory else []
+		levels = max(k for k in range(min(len(parts), 16) + 1) if k == 0 or parts[len(parts)-k:] == shardDirectory(os.path.basename(filename), k).split(os.sep))
+		basefile = os.path.join(os.sep.join(parts[:len(parts)-levels]), name)
 		reactions = basefile.split('_')
 		column = reactions.pop()
 		row = reactions.pop()
@@ -6,7 +6,10 @@ Tested with Copasi version: 4.14 (build 89)'''
 
 
 import sys					# To exit
+import os					# To read the token of the workers
 from copasi import Copasi	# Copasi class for all modifications
+from distributedCopasi import parseAddress	# To parse the address of the coordinator
+from copasiExecutor import parseChunkSize	# To parse the chunk size
 import argparse				# To parse arguments
 
 
@@ -19,7 +22,21 @@ parser.add_argument('totNumber', type=int, metavar='totalNumber', help='How ofte
 # Optionally, we take the path to CopasiSE
 parser.add_argument('-c', '--copasi', default='copasise', metavar='copasise', help='Path to CopasiSE or shell command to start CopasiSE.')
 # Optionally, we take the maximum number of parallel processes at the same time
-parser.add_argument('-p', '--parallel', type=int, default=10, metavar='#', help='Maximum number of parallel processes at the same time.')
+parser.add_argument('-p', '--parallel', type=int, default=10, metavar='#', help='Maximum number of parallel processes at the same time. Defaults to 10. 0 means one process per CPU usable by this script (respecting cgroup quota and CPU affinity) and turns on -m, so the jobs are only started while the memory suffices.')
+# Optionally, we take a wall-clock limit for every single job
+parser.add_argument('-t', '--timeout', type=float, default=None, metavar='seconds', help='Kill and record every job that runs longer than this.')
+# Optionally, we start stragglers a second time
+parser.add_argument('-s', '--speculative', type=float, default=None, metavar='percentile', help='Start a copy with a different seed of every job that runs longer than this percentile of the observed runtimes (e.g. 90). The first copy to finish is kept.')
+# Optionally, we throttle new jobs if memory gets short
+parser.add_argument('-m', '--memory', action='store_true', help='Only start new jobs if the available memory (incl. cgroup limits) suffices for the observed memory usage per job.')
+# Optionally, we run the files in chunks staged in a local scratch directory
+parser.add_argument('--chunk', type=parseChunkSize, nargs='?', const='auto', default=None, metavar='size', help='Let every parallel slot stage chunks of Copasi files in a local scratch directory, run them back to back and copy the reports back in one batch. Useful for many short jobs on shared file systems. Without size, the chunk size is tuned from the observed runtimes. Not combinable with -s and -m.')
+parser.add_argument('--scratch', default=None, metavar='dir', help='With --chunk: directory to stage the chunks in. Defaults to /dev/shm, if available, else the temporary directory of the system.')
+# Optionally, we serve the files to workers on other hosts instead of running them here
+parser.add_argument('-d', '--distribute', default=None, metavar='host:port', help='Serve the Copasi files to workers started with distributedCopasi.py instead of running them locally. A port alone listens on localhost, use e.g. 0.0.0.0:8642 to listen on all interfaces. Workers have to send the token of the environment variable COPASI_TOKEN if it is set.')
+# Optionally, we write the progress to files
+parser.add_argument('--status', default=None, metavar='status.json', help='JSON file that is updated every 10 seconds with counts, throughput, ETA and CPU utilisation of the jobs.')
+parser.add_argument('--prom', default=None, metavar='copasi.prom', help='Prometheus textfile (e.g. in the directory of the node exporter textfile collector) that is updated like --status.')
 args = parser.parse_args()
 
 
@@ -40,5 +57,9 @@ for m in range(args.totNumber):
 	# Save the modified file to disk and add it to the list of files that shall be executed in parallel
 	execList.append(copasi.saveCopasiFile(outfilebase + '.cps'))
 
-# Run all generated Copasi files in parallel
-copasi.parallelCopasi(execList, copasiPath = args.copasi, maxParallelJobs = args.parallel)
+if args.distribute is not None:
+	# Let workers on other hosts run all generated Copasi files
+	copasi.distributeCopasi(execList, parseAddress(args.distribute, 'localhost'), statusFile = args.status, promFile = args.prom, token = os.environ.get('COPASI_TOKEN'))
+else:
+	# Run all generated Copasi files in parallel. Saturating all CPUs is only safe with memory-aware admission (which is not available with chunks).
+	copasi.parallelCopasi(execList, copasiPath = args.copasi, maxParallelJobs = args.parallel, timeout = args.timeout, speculative = args.speculative, memoryAware = args.memory or (args.parallel == 0 and args.chunk is None), statusFile = args.status, promFile = args.prom, chunkSize = args.chunk, scratchDir = args.scratch)
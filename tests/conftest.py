@@ -0,0 +1,60 @@
+import os.path
+import stat
+import sys
+
+import pytest
+
+# The scripts are not installed as a package, so the tests import them from the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# A stand-in for CopasiSE. It sleeps, writes the name of the Copasi file to every report target (relative targets next to the Copasi file, like CopasiSE) and exits. Sleep and exit code can be set per file with sleep="seconds" and exitCode="code". Speculative copies (*_spec.cps) sleep specSleep="seconds" instead.
+FAKE_COPASISE = '''#!{python}
+import os, re, sys, time
+cpsFile = sys.argv[-1]
+with open(cpsFile) as f:
+	content = f.read()
+def option(name, default):
+	match = re.search(name + '="([^"]+)"', content)
+	return match.group(1) if match else default
+time.sleep(float(option('specSleep' if cpsFile.endswith('_spec.cps') else 'sleep', {seconds})))
+for target in re.findall('target="([^"]+)"', content):
+	with open(os.path.join(os.path.dirname(cpsFile), target), 'w') as report:
+		report.write('report of ' + os.path.basename(cpsFile))
+sys.exit(int(option('exitCode', 0)))
+'''
+
+
+@pytest.fixture
+def copasiSE(tmp_path):
+	"""
+	:returns: A function that writes the stand-in for CopasiSE and returns its path. Arguments: the directory (defaults to tmp_path) and the default sleep in seconds
+	"""
+
+	def write(directory = None, seconds = 0):
+		directory = str(directory or tmp_path)
+		os.makedirs(directory, exist_ok = True)
+		path = os.path.join(directory, 'copasise')
+		with open(path, 'w') as f:
+			f.write(FAKE_COPASISE.format(python = sys.executable, seconds = seconds))
+		os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+		return path
+
+	return write
+
+
+@pytest.fixture
+def cpsFiles(tmp_path):
+	"""
+	:returns: A function that writes n Copasi files model_i.cps with a report model_i.txt into tmp_path and returns their paths. Options for the stand-in CopasiSE can be given as a dictionary {i: 'sleep="5" exitCode="1"'}
+	"""
+
+	def write(n, options = None):
+		files = []
+		for i in range(n):
+			files.append(str(tmp_path / 'model_{}.cps'.format(i)))
+			with open(files[-1], 'w') as f:
+				f.write('<Report key="Report_1" target="model_{}.txt" append="1" {}/>\n'.format(i, (options or {}).get(i, '')))
+		return files
+
+	return write
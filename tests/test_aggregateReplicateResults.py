@@ -0,0 +1,83 @@
+import math
+
+import numpy as np
+
+from aggregateReplicateResults import groupReplicates, summarizeReplicates
+
+
+def result(objective, **parameters):
+	return {'objective': objective, 'evaluations': 100, 'cpuTime': 1.0, 'parameters': parameters}
+
+
+def test_replicates_are_grouped_by_their_number():
+	models = groupReplicates(['run/model_R1_R2_1.txt', 'run/model_R1_R2_12.txt', 'run/model_R1_R3_2.txt', 'run/model.txt', 'run/model_a.txt'])
+
+	assert models == {
+		'run/model_R1_R2': ['run/model_R1_R2_1.txt', 'run/model_R1_R2_12.txt'],
+		'run/model_R1_R3': ['run/model_R1_R3_2.txt'],
+		'run/model': ['run/model.txt'],
+		'run/model_a': ['run/model_a.txt'],
+	}
+
+
+def test_minimization():
+	results = [result(float(n), k = float(n)) for n in (5, 1, 4, 2, 3, 6, 7, 8, 9, 10)]
+
+	modelStats, names, parameterStats = summarizeReplicates(results, top = 0.3)
+
+	assert modelStats['replicates'] == 10 and modelStats['failed'] == 0
+	assert modelStats['best'] == 1 and modelStats['worst'] == 10
+	assert modelStats['median'] == 5.5
+	assert names == ['k']
+	assert parameterStats['best'].tolist() == [1]
+	# The best 30 % are replicates 1, 2 and 3
+	assert parameterStats['median'].tolist() == [2]
+	assert parameterStats['used'].tolist() == [3]
+
+
+def test_maximization():
+	results = [result(float(n), k = float(n)) for n in (5, 1, 4, 2, 3)]
+
+	modelStats, names, parameterStats = summarizeReplicates(results, top = 0.4, maximize = True)
+
+	assert modelStats['best'] == 5 and modelStats['worst'] == 1
+	assert modelStats['median'] == 3
+	assert parameterStats['best'].tolist() == [5]
+	assert parameterStats['median'].tolist() == [4.5]
+
+
+def test_at_least_one_replicate_is_used():
+	modelStats, names, parameterStats = summarizeReplicates([result(2.0, k = 2.0), result(1.0, k = 1.0)], top = 0.01)
+
+	assert parameterStats['used'].tolist() == [1]
+	assert parameterStats['median'].tolist() == [1]
+
+
+def test_missing_parameters_are_nan():
+	results = [result(1.0, k1 = 1.0), result(2.0, k1 = 2.0, k2 = 20.0), result(3.0, k2 = 30.0), None]
+
+	modelStats, names, parameterStats = summarizeReplicates(results, top = 0.5)
+
+	assert modelStats['replicates'] == 4 and modelStats['failed'] == 1
+	assert names == ['k1', 'k2']
+	assert parameterStats['best'][0] == 1 and math.isnan(parameterStats['best'][1])
+	# The best two replicates have k1 twice, but k2 only once
+	assert parameterStats['used'].tolist() == [2, 1]
+	assert parameterStats['median'].tolist() == [1.5, 20]
+
+
+def test_parameters_without_values_in_the_best_replicates():
+	results = [result(1.0, k1 = 1.0), result(2.0, k2 = 2.0)]
+
+	modelStats, names, parameterStats = summarizeReplicates(results, top = 0.5)
+
+	assert names == ['k1', 'k2']
+	assert parameterStats['used'].tolist() == [1, 0]
+	assert np.isnan(parameterStats['median'][1]) and np.isnan(parameterStats['quantiles'][:, 1]).all()
+
+
+def test_all_replicates_failed():
+	modelStats, names, parameterStats = summarizeReplicates([None, None])
+
+	assert modelStats == {'replicates': 2, 'failed': 2}
+	assert names == [] and parameterStats is None
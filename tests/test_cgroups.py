@@ -0,0 +1,86 @@
+import io
+
+import pytest
+
+import copasiExecutor
+from copasiExecutor import _readCgroupFile, effectiveCpuCount, availableMemory
+
+
+MEMINFO = 'MemTotal:       16000000 kB\nMemAvailable:    8000000 kB\n'
+
+
+@pytest.fixture
+def files(monkeypatch):
+	"""
+	Replaces the files copasiExecutor reads by the returned dictionary {path: content} and gives the process 8 CPUs.
+	"""
+
+	contents = {}
+	def fakeOpen(path, mode = 'r'):
+		if path not in contents:
+			raise FileNotFoundError(path)
+		return io.StringIO(contents[path])
+	monkeypatch.setattr(copasiExecutor, 'open', fakeOpen, raising = False)
+	monkeypatch.setattr(copasiExecutor.os, 'sched_getaffinity', lambda pid: set(range(8)))
+	return contents
+
+
+def test_read_from_the_own_cgroup_or_the_root_of_the_mount(files):
+	files['/proc/self/cgroup'] = '12:cpu,cpuacct:/slurm/job_1\n0::/user.slice/job_2\n'
+	files['/sys/fs/cgroup/user.slice/job_2/cpu.max'] = '200000 100000\n'
+	files['/sys/fs/cgroup/cpu/cpu.cfs_quota_us'] = '-1\n'
+
+	assert _readCgroupFile(None, 'cpu.max') == '200000 100000'
+	# The path of /proc/self/cgroup is not mounted in the container, so the root of the mount is used
+	assert _readCgroupFile('cpu', 'cpu.cfs_quota_us') == '-1'
+	assert _readCgroupFile('memory', 'memory.max') is None
+
+
+def test_cpus_without_limits(files):
+	files['/sys/fs/cgroup/cpu.max'] = 'max 100000'
+	files['/sys/fs/cgroup/cpu/cpu.cfs_quota_us'] = '-1'
+	files['/sys/fs/cgroup/cpu/cpu.cfs_period_us'] = '100000'
+
+	assert effectiveCpuCount() == 8
+
+
+@pytest.mark.parametrize('cgroupFiles, cpus', [
+	({'/sys/fs/cgroup/cpu.max': '250000 100000'}, 3),			# v2, rounded up
+	({'/sys/fs/cgroup/cpu.max': '50000 100000'}, 1),			# at least 1
+	({'/sys/fs/cgroup/cpu.max': '1600000 100000'}, 8),			# the affinity mask is lower
+	({'/sys/fs/cgroup/cpu/cpu.cfs_quota_us': '400000', '/sys/fs/cgroup/cpu/cpu.cfs_period_us': '100000'}, 4),	# v1
+])
+def test_cpus_with_quota(files, cgroupFiles, cpus):
+	files.update(cgroupFiles)
+
+	assert effectiveCpuCount() == cpus
+
+
+def test_memory_without_cgroup_limit(files):
+	files['/proc/meminfo'] = MEMINFO
+	files['/sys/fs/cgroup/memory.max'] = 'max'
+	files['/sys/fs/cgroup/memory.current'] = '1000'
+
+	assert availableMemory() == 8000000 * 1024
+
+
+def test_memory_of_cgroup_v2_without_reclaimable_cache(files):
+	files['/proc/meminfo'] = MEMINFO
+	files['/sys/fs/cgroup/memory.max'] = str(4 * 2**30)
+	files['/sys/fs/cgroup/memory.current'] = str(3 * 2**30)
+	files['/sys/fs/cgroup/memory.stat'] = 'anon 1000\ninactive_file {}\nactive_file 5\n'.format(2**30)
+
+	assert availableMemory() == 2 * 2**30
+
+
+def test_memory_of_cgroup_v1(files):
+	files['/proc/meminfo'] = MEMINFO
+	files['/sys/fs/cgroup/memory/memory.limit_in_bytes'] = str(2 * 2**30)
+	files['/sys/fs/cgroup/memory/memory.usage_in_bytes'] = str(2 * 2**30)
+	files['/sys/fs/cgroup/memory/memory.stat'] = 'cache 5\ninactive_file 7\ntotal_inactive_file {}\n'.format(2**29)
+
+	assert availableMemory() == 2**29
+
+
+def test_memory_unknown(files):
+	assert availableMemory() is None
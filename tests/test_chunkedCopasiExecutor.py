@@ -0,0 +1,80 @@
+import os
+import signal
+import subprocess
+import threading
+
+import pytest
+
+import copasiExecutor
+from copasiExecutor import ChunkedCopasiExecutor, ProgressReporter
+
+
+def makeExecutor(tmp_path, copasiPath, errors, **kwargs):
+	return ChunkedCopasiExecutor(copasiPath, 1, chunkSize = 2, scratchDir = str(tmp_path), logFile = str(tmp_path / 'copasiOut.txt'), errorReport = lambda text, fatal = False: errors.append(text), **kwargs)
+
+
+def test_failing_chunk_keeps_the_slot_alive(tmp_path, monkeypatch, cpsFiles, copasiSE):
+	files = cpsFiles(5)
+	errors = []
+	executor = makeExecutor(tmp_path, copasiSE(), errors)
+	runChunk = executor._runChunk
+	def failFirstChunk(chunk, slotDir, log):
+		if files[0] in chunk:
+			raise OSError('No space left on device')
+		runChunk(chunk, slotDir, log)
+	monkeypatch.setattr(executor, '_runChunk', failFirstChunk)
+
+	results = executor.run(files)
+
+	assert sorted(results) == sorted(files)
+	assert [results[cpsFile]['status'] for cpsFile in files] == ['failed', 'failed', 'finished', 'finished', 'finished']
+	assert len(errors) == 1 and 'No space left on device' in errors[0]
+	assert executor._taken == 0
+
+
+def test_launch_errors_fail_the_jobs(tmp_path, cpsFiles):
+	files = cpsFiles(3)
+	errors = []
+
+	results = makeExecutor(tmp_path, str(tmp_path / 'missing' / 'copasise'), errors).run(files)
+
+	assert all(results[cpsFile]['status'] == 'failed' for cpsFile in files)
+	assert len(errors) == 3
+
+
+def test_progress_is_reported_while_a_chunk_runs(tmp_path, monkeypatch, cpsFiles, copasiSE):
+	files = cpsFiles(1)
+	progress = ProgressReporter(interval = 0)
+	updates = []
+	monkeypatch.setattr(progress, 'update', lambda completed, failed, running, pending, cpuSeconds = None, force = False: updates.append((completed, running)))
+
+	results = makeExecutor(tmp_path, copasiSE(seconds = 1), [], progress = progress).run(files)
+
+	assert results[files[0]]['status'] == 'finished'
+	assert (0, 1) in updates
+	assert updates[-1] == (1, 0)
+
+
+def test_interruptions_kill_the_slots_before_the_scratch_directory_is_removed(tmp_path, monkeypatch, cpsFiles, copasiSE):
+	files = cpsFiles(4, {i: 'sleep="30"' for i in range(4)})
+	executor = makeExecutor(tmp_path, copasiSE(), [])
+	executor.maxParallelJobs = 2
+	procs = []
+	popen = subprocess.Popen
+	def recordProcs(*args, **kwargs):
+		procs.append(popen(*args, **kwargs))
+		return procs[-1]
+	monkeypatch.setattr(copasiExecutor.subprocess, 'Popen', recordProcs)
+	threads = threading.active_count()
+	# Ctrl-C while both slots run a job
+	timer = threading.Timer(1, os.kill, (os.getpid(), signal.SIGINT))
+	timer.start()
+
+	with pytest.raises(KeyboardInterrupt):
+		executor.run(files)
+	timer.join()
+
+	assert len(procs) == 2
+	assert all(proc.returncode is not None for proc in procs)
+	assert threading.active_count() == threads	# No slot is left
+	assert not [name for name in os.listdir(str(tmp_path)) if name.startswith('copasi_chunks_')]
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import copasiExecutor
+from copasiExecutor import CopasiExecutor, ProgressReporter
+
+
+def test_cpu_times_are_only_read_when_the_status_is_written(tmp_path, monkeypatch, cpsFiles, copasiSE):
+	files = cpsFiles(2)
+	reads = []
+	monkeypatch.setattr(copasiExecutor, '_processCpuTime', lambda pid: reads.append(pid) or 0.0)
+	progress = ProgressReporter(statusFile = str(tmp_path / 'status.json'), interval = 60)
+
+	results = CopasiExecutor(copasiSE(seconds = 1), 2, progress = progress, logFile = str(tmp_path / 'copasiOut.txt')).run(files)
+
+	assert all(result['status'] == 'finished' for result in results.values())
+	# Only the first write happens while jobs run, the final one is forced after all jobs are reaped
+	assert len(reads) <= len(files)
+	assert os.path.exists(str(tmp_path / 'status.json'))
+
+
+def makeExecutor(tmp_path, copasiPath, maxParallelJobs, errors, **kwargs):
+	return CopasiExecutor(copasiPath, maxParallelJobs, logFile = str(tmp_path / 'copasiOut.txt'), errorReport = lambda text, fatal = False: errors.append(text), **kwargs)
+
+
+def readReport(tmp_path, i):
+	with open(str(tmp_path / 'model_{}.txt'.format(i))) as f:
+		return f.read()
+
+
+def test_jobs_exceeding_the_timeout_are_killed(tmp_path, cpsFiles, copasiSE):
+	files = cpsFiles(2, {1: 'sleep="30"'})
+	errors = []
+
+	results = makeExecutor(tmp_path, copasiSE(), 2, errors, timeout = 1).run(files)
+
+	assert results[files[0]]['status'] == 'finished'
+	assert results[files[1]]['status'] == 'timeout' and results[files[1]]['exitCode'] is None
+	assert results[files[1]]['runtime'] < 10
+	assert len(errors) == 1
+
+
+def test_speculative_copy_of_a_straggler_wins(tmp_path, cpsFiles, copasiSE):
+	files = cpsFiles(3, {2: 'sleep="30" specSleep="0"'})
+
+	results = makeExecutor(tmp_path, copasiSE(), 3, [], speculative = 50, minSamples = 2).run(files)
+
+	assert all(result['status'] == 'finished' for result in results.values())
+	assert results[files[2]]['speculative'] and results[files[2]]['runtime'] < 10
+	# The report of the copy replaces the one of the original
+	assert readReport(tmp_path, 2) == 'report of model_2_spec.cps'
+	assert sorted(os.listdir(str(tmp_path))) == sorted(['copasise', 'copasiOut.txt'] + ['model_{}.{}'.format(i, ext) for i in range(3) for ext in ('cps', 'txt')])
+
+
+def test_original_wins_against_its_speculative_copy(tmp_path, cpsFiles, copasiSE):
+	files = cpsFiles(3, {2: 'sleep="1.5" specSleep="30"'})
+	executor = makeExecutor(tmp_path, copasiSE(), 3, [], speculative = 50, minSamples = 2)
+	copies = []
+	start = executor._start
+	def recordCopies(cpsFile, log):
+		if cpsFile.endswith('_spec.cps'):
+			copies.append(cpsFile)
+		return start(cpsFile, log)
+	executor._start = recordCopies
+
+	results = executor.run(files)
+
+	assert copies == [str(tmp_path / 'model_2_spec.cps')]
+	assert results[files[2]]['status'] == 'finished' and not results[files[2]]['speculative']
+	assert readReport(tmp_path, 2) == 'report of model_2.cps'
+	assert not os.path.exists(copies[0]) and not os.path.exists(str(tmp_path / 'model_2_spec.txt'))
+
+
+def test_interruptions_kill_all_jobs(tmp_path, cpsFiles, copasiSE):
+	files = cpsFiles(3, {1: 'sleep="30" specSleep="30"', 2: 'sleep="30"'})
+	executor = makeExecutor(tmp_path, copasiSE(), 3, [], speculative = 50, minSamples = 1, progress = ProgressReporter())
+	procs = []
+	start = executor._start
+	def recordProcs(cpsFile, log):
+		procs.append(start(cpsFile, log))
+		return procs[-1]
+	executor._start = recordProcs
+	# Ctrl-C as soon as a speculative copy runs
+	def interrupt(results, running, pending, cpuStart, force = False):
+		if any(job.original is not None for job in running):
+			raise KeyboardInterrupt
+	executor._reportProgress = interrupt
+
+	with pytest.raises(KeyboardInterrupt):
+		executor.run(files)
+
+	assert len(procs) == 4
+	assert all(proc.returncode is not None for proc in procs)
+	assert not [name for name in os.listdir(str(tmp_path)) if '_spec' in name]
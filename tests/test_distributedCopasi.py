@@ -0,0 +1,86 @@
+import os
+import threading
+
+from distributedCopasi import Coordinator, Worker
+
+
+def runDistributed(files, copasiPath, workers = 2, coordinatorToken = None, workerToken = None):
+	errors = []
+	coordinator = Coordinator(files, ('localhost', 0), heartbeatTimeout = 10, logFile = os.path.join(os.path.dirname(files[0]), 'copasiOut.txt'), errorReport = lambda text, fatal = False: errors.append(text), token = coordinatorToken)
+	threads = [threading.Thread(target = Worker(coordinator.address, copasiPath, connectTimeout = 5, token = workerToken).run, daemon = True) for _ in range(workers)]
+	for thread in threads:
+		thread.start()
+	results = coordinator.run()
+	for thread in threads:
+		thread.join(10)
+	return results, errors
+
+
+def test_workers_run_all_jobs(tmp_path, monkeypatch, cpsFiles, copasiSE):
+	files = cpsFiles(5)
+	copasiSE(tmp_path / 'bin')
+	# A relative path to CopasiSE has to work although CopasiSE runs in a scratch directory
+	monkeypatch.chdir(str(tmp_path))
+
+	results, errors = runDistributed(files, './bin/copasise', coordinatorToken = 'secret', workerToken = 'secret')
+
+	assert errors == []
+	assert sorted(results) == sorted(files)
+	assert all(result['status'] == 'finished' and result['exitCode'] == 0 for result in results.values())
+	for i in range(5):
+		with open(str(tmp_path / 'model_{}.txt'.format(i))) as f:
+			assert f.read() == 'report of model_{}.cps'.format(i)
+
+
+def test_launch_errors_fail_the_jobs(tmp_path, cpsFiles):
+	files = cpsFiles(3)
+
+	results, errors = runDistributed(files, str(tmp_path / 'missing' / 'copasise'), workers = 1)
+
+	assert sorted(results) == sorted(files)
+	assert all(result['status'] == 'failed' and result['exitCode'] is None for result in results.values())
+	with open(str(tmp_path / 'copasiOut.txt')) as f:
+		assert 'model_0.cps' in f.read()
+
+
+def test_unreadable_files_fail_the_jobs(tmp_path, cpsFiles, copasiSE):
+	files = cpsFiles(2) + [str(tmp_path / 'missing.cps')]
+
+	results, errors = runDistributed(files, copasiSE(), workers = 1)
+
+	assert results[files[2]]['status'] == 'failed'
+	assert results[files[0]]['status'] == results[files[1]]['status'] == 'finished'
+	assert len(errors) == 1
+
+
+def test_invalid_results_are_ignored(tmp_path, cpsFiles):
+	files = cpsFiles(2)
+	errors = []
+	coordinator = Coordinator(files, ('localhost', 0), errorReport = lambda text, fatal = False: errors.append(text))
+	try:
+		# Neither unknown ids nor jobs that were never handed out are accepted
+		for jobId in (2, -1, 'model_0.cps', None, [0], True, 0):
+			coordinator._finish({'type': 'result', 'id': jobId, 'exitCode': 0, 'status': 'finished', 'reports': ['fake'], 'log': ''})
+	finally:
+		coordinator.server.server_close()
+
+	assert coordinator.results == {}
+	assert len(errors) == 7
+	assert not os.path.exists(str(tmp_path / 'model_0.txt'))
+
+
+def test_workers_with_a_wrong_token_are_refused(cpsFiles, copasiSE):
+	files = cpsFiles(1)
+	errors = []
+	coordinator = Coordinator(files, ('localhost', 0), errorReport = lambda text, fatal = False: errors.append(text), token = 'secret')
+	thread = threading.Thread(target = coordinator.server.serve_forever, daemon = True)
+	thread.start()
+	try:
+		done = Worker(coordinator.address, copasiSE(), connectTimeout = 5, token = 'wrong').run()
+	finally:
+		coordinator.server.shutdown()
+		coordinator.server.server_close()
+
+	assert done == 0
+	assert coordinator.results == {} and not coordinator.handedOut
+	assert len(errors) == 1
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+from copasi import BulkWriter, shardDirectory
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'extractMCAOptimizationResults.py')
+
+
+def writeReport(filename, value):
+	os.makedirs(os.path.dirname(filename), exist_ok = True)
+	with open(filename, 'w') as f:
+		f.write('Objective Function Value:\t{}\n'.format(value))
+
+
+def test_sharded_names_with_special_characters(tmp_path):
+	writer = BulkWriter(shardLevels = 2)
+	first = writer.path('scan/model_Hexo kinase_R2.txt')
+	second = writer.path('scan/model_R-3 (fast)_R2.txt')
+	writer.close()
+	assert first == os.path.join('scan', shardDirectory('model_Hexokinase_R2.txt', 2), 'model_Hexokinase_R2.txt')
+	writeReport(str(tmp_path / first), 0.5)
+	writeReport(str(tmp_path / second), 0.25)
+
+	subprocess.check_call([sys.executable, SCRIPT, first, second], cwd = str(tmp_path))
+
+	# A single summary per scan, not one per shard
+	summaries = [os.path.join(root, name) for root, _, names in os.walk(str(tmp_path)) for name in names if name.endswith('_summary.txt')]
+	assert summaries == [str(tmp_path / 'scan' / 'model_summary.txt')]
+	with open(summaries[0]) as f:
+		assert sorted(f.read().split('\n')) == ['Hexokinase\tR2\t0.5', 'R3fast\tR2\t0.25']
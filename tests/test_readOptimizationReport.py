@@ -0,0 +1,30 @@
+import os.path
+
+from copasi import readOptimizationReport
+
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def test_last_result_with_parameters():
+	result = readOptimizationReport(os.path.join(DATA, 'optimization_report.txt'))
+
+	assert result['objective'] == 0.823167
+	assert result['evaluations'] == 8040
+	assert result['parameters'] == {'Values[k1].InitialValue': 9.99998, '(R1).k2': 0.0100013}
+
+
+def test_parameters_end_at_next_block(tmp_path):
+	report = tmp_path / 'report.txt'
+	report.write_text('    Objective Function Value:\t1.5\n    Function Evaluations:\t10\n\n    Values[k1].InitialValue: 2\nSomething else\n    (R1).k2: 3\n')
+
+	result = readOptimizationReport(str(report))
+
+	assert result['parameters'] == {'Values[k1].InitialValue': 2.0}
+
+
+def test_report_without_result(tmp_path):
+	report = tmp_path / 'report.txt'
+	report.write_text('Optimization\n')
+
+	assert readOptimizationReport(str(report)) is None
@@ -0,0 +1,38 @@
+import os.path
+import re
+
+from copasi import Copasi
+
+
+MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'model.cps')
+
+
+def keys(copasi, element):
+	return re.findall('<{} key="([^"]+)"'.format(element), copasi.content)
+
+
+def test_referenced_tasks_and_reports_are_kept():
+	copasi = Copasi(MODEL)
+
+	saved = copasi.slimModel()
+
+	# Steady-State is the subtask of the optimization (TaskList[...]) and used by the MCA by key (Task_14). The MCA is part of the objective.
+	assert keys(copasi, 'Task') == ['Task_14', 'Task_16', 'Task_17']
+	# The reports of the optimization and of the kept MCA
+	assert keys(copasi, 'Report') == ['Report_10', 'Report_11']
+	for part in ('layouts', 'plots', 'annotations', 'comments', 'sbml reference', 'tasks', 'reports'):
+		assert saved[part] > 0
+	for element in ('<ListOfLayouts', '<ListOfPlots>', '<MiriamAnnotation>', '<Comment>', '<SBMLReference'):
+		assert element not in copasi.content
+	# The model itself is untouched
+	assert copasi.getReactions() == Copasi(MODEL).getReactions()
+
+
+def test_unscheduled_tasks_can_be_kept():
+	copasi = Copasi(MODEL)
+
+	copasi.slimModel(keepTasks = ('Time-Course',))
+
+	assert keys(copasi, 'Task') == ['Task_14', 'Task_15', 'Task_16', 'Task_17']
+	# The report of the time course is only used by its name in the report itself, not by the task
+	assert keys(copasi, 'Report') == ['Report_10', 'Report_11']
@@ -0,0 +1,29 @@
+import os.path
+import shutil
+
+from copasi import WarmStart
+
+
+REPORT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'optimization_report.txt')
+
+
+def copyReports(tmp_path, names):
+	files = []
+	for name in names:
+		shutil.copyfile(REPORT, str(tmp_path / name))
+		files.append(str(tmp_path / name))
+	return files
+
+
+def test_names_with_and_without_jobarray_number(tmp_path):
+	warmStart = WarmStart(copyReports(tmp_path, ['my_model_R1_R2.txt', 'my_model_R2_R3_7.txt', 'model.txt']), maximize = True)
+
+	assert sorted(warmStart.results) == [('R1', 'R2'), ('R2', 'R3')]
+	assert warmStart.lookup('R1', 'R2', ('R1', 'R2', 'R3'), ('R1', 'R2', 'R3')) == {'Values[k1].InitialValue': 9.99998, '(R1).k2': 0.0100013}
+
+
+def test_model_names_decide_about_numbers(tmp_path):
+	# Without jobarray, the column may be a number itself
+	warmStart = WarmStart(copyReports(tmp_path, ['model_R1_2.txt']), rows = ('R1', 'R2'), columns = ('1', '2'))
+
+	assert list(warmStart.results) == [('R1', '2')]
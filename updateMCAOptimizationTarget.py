@@ -15,8 +15,10 @@ Start the script e.g. like this:
 
 
 import sys
-from copasi import Copasi	# Copasi class for all modifications
-import argparse				# To parse arguments
+import os.path				# Common path name manipulations
+from copasi import Copasi, WarmStart, shardedPath, parseMethodSpec, parseMethodList, formatMethodSpec	# Copasi class for all modifications
+from distributedCopasi import parseAddress	# To parse the address of the coordinator
+from copasiExecutor import parseChunkSize	# To parse the chunk size
 
 
 def makeList(x):
@@ -30,101 +32,250 @@ def makeList(x):
 	return x.split(',')
 
 
-# Create a new argument parser object
-parser = argparse.ArgumentParser(description=helptext)
-# We need one input file
-parser.add_argument('infile', metavar='myfile.cps', help='Copasi file that shall be modified and run.')
-# List of row parameters
-parser.add_argument('objLeft', type=makeList, metavar='rows', help='The parameters of rows that shall be changed. These can be numbers, names or both, seperated by kommas (,). May also be "all" without quotation marks to address all parameters.')
-# List of column parameters
-parser.add_argument('objRight', type=makeList, metavar='columns', help='The parameters of columns that shall be changed. See "rows" for details.')
-# Optionally, we take a switch to use a server Jobarray instead of a local system
-parser.add_argument('-j', '--jobarray', action='store_true', help='If active, Copasi filenames are just numbered and not changed to meaningful names. This implies -n.')
-# Optionally, we take a switch whether to run the generated files or not
-parser.add_argument('-n', '--norun', action='store_true', help='If active, Copasi files are just generated but Copasi is not started.')
-args = parser.parse_args()
-
-
-objectiveleft = args.objLeft
-objectiveright = args.objRight
-
-# if the files are prepared for a jobarray, we don't want to run them anyway on the local computer
-if args.jobarray:
-	args.norun = True
-
-# create a basefile that is the infile without ending
-basefile = args.infile.replace('.cps', '')
-
-# create a new Copasi instance
-copasi = Copasi(args.infile)
-
-# Get a list of reactions and (usable) metabolites with name and number
-reactions = copasi.getReactions()
-metabolites = copasi.getMetabolites()
-
-# See, what kind of components we need for left and right objectives (reactions or metabolites)
-mcatype = copasi.getMCAType()
-if mcatype == 'ccc':
-	lefttype = metabolites
-	righttype = reactions
-elif mcatype == 'e':
-	lefttype = reactions
-	righttype = metabolites
-elif mcatype == 'fcc':
-	lefttype = reactions
-	righttype = reactions
-else:
-	print('This MCA type is unknown: {}. Aborting.'.format(mcatype), file=sys.stderr)
-	sys.exit(56)
-
-# replace the keyword "all" with the full list of reactions/metabolites
-if objectiveleft[0] == 'all':
-	objectiveleft = list(lefttype)
-if objectiveright[0] == 'all':
-	objectiveright = list(righttype)
-
-# turn every element of the lists into an integer
-objectiveleft = copasi.turnToNumbers(objectiveleft, lefttype)
-objectiveright = copasi.turnToNumbers(objectiveright, righttype)
-
-execList = []	# This list saves all copasi-files in order to execute them later
-
-i = 1 # This variable is used for renaming the files when they are used on Stallo
-
-# modify the original file for each objective-pair and create new files accordingly
-for objleft in objectiveleft:
-	if objleft >= len(lefttype):
-		print('The objective ({0}) is not part of the model! Continuing with other objectives.'.format(objleft), file=sys.stderr)
-		continue
-
-	for objright in objectiveright:
-		if objright >= len(righttype):
-			print('The objective ({0}) is not part of the model! Continuing with other objectives.'.format(objright), file=sys.stderr)
-			continue
+def getTargetTypes(copasi):
+	"""
+	Determines the MCA type of a Copasi file and the kind of components for the left and right objectives. Aborts if the MCA type is unknown.
 
-		# It doesn't make sense to have both parts the same in FCC, as both are reactions. In ccc and e, one is reaction, the other metabolite, so it's ok
-		if objleft == objright and mcatype == 'fcc':
-			continue
+	:param copasi: A Copasi object
+	:returns: A tuple (mcatype, lefttype, righttype) where lefttype and righttype are the tuples of reactions or metabolites
+	"""
+
+	# Get a list of reactions and (usable) metabolites with name and number
+	reactions = copasi.getReactions()
+	metabolites = copasi.getMetabolites()
+
+	# See, what kind of components we need for left and right objectives (reactions or metabolites)
+	mcatype = copasi.getMCAType()
+	if mcatype == 'ccc':
+		lefttype = metabolites
+		righttype = reactions
+	elif mcatype == 'e':
+		lefttype = reactions
+		righttype = metabolites
+	elif mcatype == 'fcc':
+		lefttype = reactions
+		righttype = reactions
+	else:
+		print('This MCA type is unknown: {}. Aborting.'.format(mcatype), file=sys.stderr)
+		sys.exit(56)
+
+	return mcatype, lefttype, righttype
+
+
+def getTargetPairs(copasi, objectiveleft, objectiveright):
+	"""
+	Determines all valid pairs of left and right objectives. Objectives that are not part of the model are skipped with a message. In FCC, pairs of the same reaction are skipped.
+
+	:param copasi: A Copasi object
+	:param objectiveleft: A list of numbers or names of the left objectives (rows) or ['all']
+	:param objectiveright: A list of numbers or names of the right objectives (columns) or ['all']
+	:returns: A list of tuples (objleft, objright) with the numbers of the objectives
+	"""
+
+	mcatype, lefttype, righttype = getTargetTypes(copasi)
 
-		outfilebase = basefile + '_' + lefttype[objleft] + '_' + righttype[objright]
+	# replace the keyword "all" with the full list of reactions/metabolites
+	if objectiveleft[0] == 'all':
+		objectiveleft = list(lefttype)
+	if objectiveright[0] == 'all':
+		objectiveright = list(righttype)
 
-		if args.jobarray:
-			outfilebase += '_' + str(i)
+	# turn every element of the lists into an integer
+	objectiveleft = copasi.turnToNumbers(list(objectiveleft), lefttype)
+	objectiveright = copasi.turnToNumbers(list(objectiveright), righttype)
+
+	pairs = []
+	for objleft in objectiveleft:
+		if objleft >= len(lefttype):
+			print('The objective ({0}) is not part of the model! Continuing with other objectives.'.format(objleft), file=sys.stderr)
+			continue
 
-		# replace the original reactions/metabolites with the new ones
-		copasi.setMCAOptiParameters(objleft, objright)
+		for objright in objectiveright:
+			if objright >= len(righttype):
+				print('The objective ({0}) is not part of the model! Continuing with other objectives.'.format(objright), file=sys.stderr)
+				continue
 
-		# Set the task to Metabolic Control Analysis
-		copasi.setTaskToMCA()
+			# It doesn't make sense to have both parts the same in FCC, as both are reactions. In ccc and e, one is reaction, the other metabolite, so it's ok
+			if objleft == objright and mcatype == 'fcc':
+				continue
 
-		# replace the report file name
-		copasi.setReportFileName(outfilebase + '.txt')
+			pairs.append((objleft, objright))
 
-		# Save the modified file to disk and add it to the list of files that shall be executed in parallel
-		execList.append(copasi.saveCopasiFile(outfilebase + '.cps'))
+	return pairs
 
-		i += 1
 
-if not args.norun:
-	# Run all generated Copasi files in parallel
-	copasi.parallelCopasi(execList)#, copasiPath = 'echo') # echo is for debugging
+def generateVariants(copasi, objectiveleft, objectiveright, basefile, jobarray = False, shardLevels = 0, warmStart = None, warmBudget = 1.0):
+	"""
+	Generates a Copasi file for every pair of left and right objectives. Nothing is written to disk, so the variants can be written in bulk (Copasi.bulkWriter()) or be run while they are generated (Copasi.pipelineCopasi()).
+
+	:param copasi: A Copasi object. Its content is modified for every variant
+	:param objectiveleft: A list of numbers or names of the left objectives (rows) or ['all']
+	:param objectiveright: A list of numbers or names of the right objectives (columns) or ['all']
+	:param basefile: The file name of the variants without target names and ending (may include some path)
+	:param jobarray: If True, the file names are numbered in addition
+	:param shardLevels: Number of levels of hashed subdirectories for the variants. Their reports are written next to them
+	:param warmStart: A WarmStart object with results of previous scans. The best parameters of the same (or the nearest) pair of targets are used as start values. None keeps the start values of the Copasi file
+	:param warmBudget: Factor for the iteration limits of the optimization method of variants with warm start values
+	:returns: A generator of tuples (filename, content, (row name, column name))
+	"""
+
+	# The targets are resolved and checked right away and not only when the first variant is requested, which may happen in another thread (Copasi.pipelineCopasi())
+	mcatype, lefttype, righttype = getTargetTypes(copasi)
+	pairs = getTargetPairs(copasi, objectiveleft, objectiveright)
+	if not pairs:
+		copasi._errorReport('No valid pair of targets found.', fatal = True)
+	copasi.setMCAOptiParameters(*pairs[0])
+
+	if warmStart is not None:
+		# Every variant starts from the original start values and budget, unless previous results are available
+		items = copasi.getOptimizationItems()
+		budget = copasi.getOptimizationBudget()
+		warmedBudget = {name: max(1, int(round(value * warmBudget))) for name, value in budget.items()}
+
+	def variants():
+		i = 1 # This variable is used for renaming the files when they are used on Stallo
+
+		# modify the original file for each objective-pair and create new files accordingly
+		for objleft, objright in pairs:
+			outfilebase = basefile + '_' + lefttype[objleft] + '_' + righttype[objright]
+
+			if jobarray:
+				outfilebase += '_' + str(i)
+
+			# replace the original reactions/metabolites with the new ones
+			copasi.setMCAOptiParameters(objleft, objright)
+
+			# Set the task to Metabolic Control Analysis
+			copasi.setTaskToMCA()
+
+			# Start from the best parameters of previous scans with a reduced budget
+			if warmStart is not None:
+				values = warmStart.lookup(lefttype[objleft], righttype[objright], lefttype, righttype)
+				copasi.setOptimizationStartValues(values or {}, items)
+				copasi.setOptimizationBudget(warmedBudget if values else budget)
+
+			# The hash of the shard directories is taken over the sanitized name, which is all extractMCAOptimizationResults.py knows
+			cpsFile = shardedPath(copasi._getValidFilename(outfilebase + '.cps'), shardLevels)
+
+			# replace the report file name. In shard directories, the report is written next to the Copasi file (Copasi resolves relative names from there).
+			copasi.setReportFileName(os.path.splitext(os.path.basename(cpsFile) if shardLevels else cpsFile)[0] + '.txt')
+
+			yield cpsFile, copasi.content, (lefttype[objleft], righttype[objright])
+
+			i += 1
+
+	return variants()
+
+
+if __name__ == '__main__':
+	import argparse				# To parse arguments
+
+	# Create a new argument parser object
+	parser = argparse.ArgumentParser(description=helptext)
+	# We need one input file
+	parser.add_argument('infile', metavar='myfile.cps', help='Copasi file that shall be modified and run.')
+	# List of row parameters
+	parser.add_argument('objLeft', type=makeList, metavar='rows', help='The parameters of rows that shall be changed. These can be numbers, names or both, seperated by kommas (,). May also be "all" without quotation marks to address all parameters.')
+	# List of column parameters
+	parser.add_argument('objRight', type=makeList, metavar='columns', help='The parameters of columns that shall be changed. See "rows" for details.')
+	# Optionally, we take a switch to use a server Jobarray instead of a local system
+	parser.add_argument('-j', '--jobarray', action='store_true', help='If active, Copasi filenames are just numbered and not changed to meaningful names. This implies -n.')
+	# Optionally, we take a switch whether to run the generated files or not
+	parser.add_argument('-n', '--norun', action='store_true', help='If active, Copasi files are just generated but Copasi is not started.')
+	# Optionally, we write the files with several threads
+	parser.add_argument('-w', '--writers', type=int, default=8, metavar='#', help='Number of threads that write the generated Copasi files.')
+	# Optionally, we spread the files over hashed subdirectories
+	parser.add_argument('--shard', type=int, default=0, metavar='levels', help='Write the generated Copasi files (and their reports) into this many levels of hashed subdirectories with 256 entries each, e.g. 1 for 250,000 files. A manifest (myfile_manifest.tsv) maps the targets to the files.')
+	# Optionally, we run the files while they are generated
+	parser.add_argument('-P', '--pipeline', action='store_true', help='Start CopasiSE as soon as the first Copasi file is generated instead of generating all files first. Implies local execution.')
+	parser.add_argument('--queue', type=int, default=0, metavar='#', help='With --pipeline: maximum number of generated Copasi files waiting for execution. Defaults to twice the number of parallel jobs.')
+	parser.add_argument('--delete-inputs', action='store_true', help='With --pipeline: delete every Copasi file as soon as its report is written.')
+	# Optionally, we start from the results of previous scans
+	parser.add_argument('--warm-start', nargs='+', default=None, metavar='myfile_R1_R2.txt', help='Reports of previous scans. May include placeholders like * and [1-4]. The best parameters of the same (or the nearest) pair of targets are used as start values.')
+	parser.add_argument('--warm-budget', type=float, default=0.25, metavar='factor', help='With --warm-start: factor for the iteration limits of the optimization method of variants with warm start values. Defaults to 0.25.')
+	# Optionally, we remove everything from the Copasi file that is not needed to run the optimization
+	parser.add_argument('--slim', action='store_true', help='Remove layouts, plots, annotations, unused tasks and unused reports from the generated Copasi files to reduce the startup time of CopasiSE.')
+	# Optionally, we set the optimization method or let several methods race for it
+	parser.add_argument('--method', type=parseMethodSpec, default=None, metavar='EP:generations=200,population=40', help='Optimization method for all Copasi files (EP or PS), optionally with parameters (generations, population, iterations, swarmSize, stdDeviation, seed).')
+	parser.add_argument('--race', type=parseMethodList, default=None, metavar='EP,PS:iterations=500', help='Candidate optimization methods (like --method), seperated by kommas (,). Every candidate runs with a reduced budget on a sample of the targets before the scan and the best one is used for all Copasi files.')
+	parser.add_argument('--race-sample', type=int, default=5, metavar='#', help='With --race: number of randomly chosen targets to race on. Defaults to 5.')
+	parser.add_argument('--race-budget', type=float, default=0.1, metavar='factor', help='With --race: factor for the iteration limits of the candidates during the race. Defaults to 0.1.')
+	parser.add_argument('--race-timeout', type=float, default=None, metavar='seconds', help='With --race: kill every run of the race that takes longer than this. Such runs rank last. Defaults to the limit of -t or, without -t, to 600 seconds.')
+	# Optionally, we take a wall-clock limit for every single job
+	parser.add_argument('-t', '--timeout', type=float, default=None, metavar='seconds', help='Kill and record every job that runs longer than this.')
+	# Optionally, we start stragglers a second time
+	parser.add_argument('-s', '--speculative', type=float, default=None, metavar='percentile', help='Start a copy with a different seed of every job that runs longer than this percentile of the observed runtimes (e.g. 90). The first copy to finish is kept.')
+	# Optionally, we throttle new jobs if memory gets short
+	parser.add_argument('-m', '--memory', action='store_true', help='Only start new jobs if the available memory (incl. cgroup limits) suffices for the observed memory usage per job.')
+	# Optionally, we run the files in chunks staged in a local scratch directory
+	parser.add_argument('--chunk', type=parseChunkSize, nargs='?', const='auto', default=None, metavar='size', help='Let every parallel slot stage chunks of Copasi files in a local scratch directory, run them back to back and copy the reports back in one batch. Useful for many short jobs on shared file systems. Without size, the chunk size is tuned from the observed runtimes. Not combinable with -s and -m.')
+	parser.add_argument('--scratch', default=None, metavar='dir', help='With --chunk: directory to stage the chunks in. Defaults to /dev/shm, if available, else the temporary directory of the system.')
+	# Optionally, we serve the files to workers on other hosts instead of running them here
+	parser.add_argument('-d', '--distribute', default=None, metavar='host:port', help='Serve the Copasi files to workers started with distributedCopasi.py instead of running them locally. A port alone listens on localhost, use e.g. 0.0.0.0:8642 to listen on all interfaces. Workers have to send the token of the environment variable COPASI_TOKEN if it is set.')
+	# Optionally, we write the progress to files
+	parser.add_argument('--status', default=None, metavar='status.json', help='JSON file that is updated every 10 seconds with counts, throughput, ETA and CPU utilisation of the jobs.')
+	parser.add_argument('--prom', default=None, metavar='copasi.prom', help='Prometheus textfile (e.g. in the directory of the node exporter textfile collector) that is updated like --status.')
+	args = parser.parse_args()
+
+	# if the files are prepared for a jobarray, we don't want to run them anyway on the local computer
+	if args.jobarray:
+		args.norun = True
+
+	# create a basefile that is the infile without ending
+	basefile = args.infile.replace('.cps', '')
+
+	# create a new Copasi instance
+	copasi = Copasi(args.infile)
+
+	if args.slim:
+		# The Metabolic Control Analysis becomes the subtask of the optimization in every variant
+		saved = copasi.slimModel(keepTasks = ('Metabolic Control Analysis',))
+		print('Slimmed the Copasi file by {} bytes ({}).'.format(sum(saved.values()), ', '.join('{} {}'.format(part, n) for part, n in saved.items() if n > 0)))
+
+	if args.method is not None:
+		copasi.setOptimizationMethod(**args.method)
+
+	if args.race is not None:
+		import random		# To sample the targets of the race
+		pairs = getTargetPairs(copasi, args.objLeft, args.objRight)
+		sample = random.sample(pairs, min(args.race_sample, len(pairs)))
+		# A stuck candidate must not block the scan, so the race has a time limit as well
+		winner, scores = copasi.raceOptimizationMethods(args.race, sample, budget = args.race_budget, timeout = args.race_timeout or args.timeout or 600)
+		print('Race of optimization methods on {} targets (mean rank, function evaluations):'.format(len(sample)))
+		for candidate, (rank, evals) in zip(args.race, scores):
+			print('{}{}\t{:.2f}\t{:.0f}'.format('* ' if candidate is winner else '  ', formatMethodSpec(candidate), rank, evals))
+
+	warmStart = None
+	if args.warm_start is not None:
+		from glob import glob		# To expand placeholders
+		mcatype, lefttype, righttype = getTargetTypes(copasi)
+		warmStart = WarmStart([fn for pattern in args.warm_start for fn in glob(pattern)], copasi.isMaximization(), lefttype, righttype)
+		if len(warmStart) == 0:
+			copasi._errorReport('No results found in the reports for the warm start.')
+
+	variants = generateVariants(copasi, args.objLeft, args.objRight, basefile, args.jobarray, args.shard, warmStart, args.warm_budget)
+	manifest = basefile + '_manifest.tsv' if args.shard else None
+
+	if args.pipeline and not args.norun and args.distribute is None:
+		# Run the Copasi files while they are generated
+		copasi.pipelineCopasi(variants, queueSize = args.queue, deleteInputs = args.delete_inputs, manifest = manifest, timeout = args.timeout, speculative = args.speculative, memoryAware = args.memory, statusFile = args.status, promFile = args.prom, chunkSize = args.chunk, scratchDir = args.scratch)
+		sys.exit()
+
+	execList = []	# This list saves all copasi-files in order to execute them later
+
+	# All variants are written in parallel. With sharding, a manifest maps the targets to the files.
+	writer = copasi.bulkWriter(args.writers, args.shard, manifest)
+
+	# Save the modified files to disk and add them to the list of files that shall be executed in parallel
+	for cpsFile, content, targets in variants:
+		execList.append(writer.write(cpsFile, content, targets))
+
+	# Wait until all files are on disk
+	writer.close()
+
+	if args.distribute is not None and not args.norun:
+		# Let workers on other hosts run all generated Copasi files
+		copasi.distributeCopasi(execList, parseAddress(args.distribute, 'localhost'), statusFile = args.status, promFile = args.prom, token = os.environ.get('COPASI_TOKEN'))
+	elif not args.norun:
+		# Run all generated Copasi files in parallel
+		copasi.parallelCopasi(execList, timeout = args.timeout, speculative = args.speculative, memoryAware = args.memory, statusFile = args.status, promFile = args.prom, chunkSize = args.chunk, scratchDir = args.scratch)#, copasiPath = 'echo') # echo is for debugging